@@ -1,68 +1,175 @@
 import argparse
+import contextlib
+import copy
+import io
+import itertools
 import json
-import matplotlib.pyplot as plt
+import re
 import numpy as np
-from astropy.coordinates import SkyCoord, AltAz, EarthLocation, ICRS
-from astropy import units as u
-from astropy.time import Time
-from astropy.wcs import WCS
-from astropy.io import fits
-from scipy.signal import convolve2d
 import tempfile, os
 
 import astrofluxlib as aflux
 
 import sys
-    
-def main():
-    parser = argparse.ArgumentParser(description='A CLI for running radio interferometry simulations')
-    parser.add_argument('--sky', type=str, help='"cross" | "stars" | path to FITS sky map file', required=True)
+
+# matplotlib is imported only when plotting, with a non-interactive 
+# backend for --dump and --serve
+
+def build_parser(add_help=True):
+    """
+    Parameters
+    ----------
+    add_help : bool
+        add the -h/--help option, which prints to stdout (left out for
+        server and batch requests, whose stdout is JSON lines)
+
+    Returns
+    -------
+    parser : argparse.ArgumentParser
+        parser for the command line (and server request) options
+    """
+    parser = argparse.ArgumentParser(description='A CLI for running radio interferometry simulations', add_help=add_help)
+    parser.add_argument('--sky', type=str, help='"cross" | "stars" | path to FITS sky map file')
+    parser.add_argument('--interpolation', choices=('nearest', 'bilinear'), default='nearest', help='FITS sky map sampling')
     parser.add_argument('--json', type=str, help='JSON input string')
     parser.add_argument('--file', type=str, help='path to observation JSON input file')
     parser.add_argument('--duration', type=float, help='observation duration in hours')
     parser.add_argument('--samples', type=int, help='number of samples per short term interval')
     parser.add_argument('--snr', type=float, help='SNR of antenna signals')
+    parser.add_argument('--seed', type=int, help='seed for the noise, star field and random array (default random)')
     parser.add_argument('--fast', action='store_true', help='simulate all antennas with the parameters')
+    parser.add_argument('--group-beams', action='store_true', help='simulate antennas with the same dish size together')
     parser.add_argument('--spiral', metavar='RADIUS', type=float, help='generate spiral array with this max radius in meters')
     parser.add_argument('--random', metavar='RADIUS', type=float, help='generate random array positions on this order')
     parser.add_argument('--count', metavar='NUM_ANTENNAS', type=int, help='number of antennas for generated array')
     parser.add_argument('--size', metavar='DISH_SIZE', type=float, help='size of generate dishes')
     parser.add_argument('--save', type=str, help='save generated configuration to this output path')
+    parser.add_argument('--optimize', metavar='CANDIDATES', type=int, help='score this many --random layouts of --count antennas by their gridded dirty beams and print (and --save) the best one')
+    parser.add_argument('--optimize-metric', choices=('sidelobe', 'beamwidth', 'fill'), default='sidelobe', help='layout score for --optimize: lowest sidelobe level, narrowest beam or highest uv fill fraction')
     parser.add_argument('--dump', action='store_true', help='dump output as JSON string in stdout')
-    args = parser.parse_args()
+    parser.add_argument('--output-format', choices=('jpg', 'npz', 'npy'), default='jpg', help='write rendered jpg images, an npz archive or raw npy arrays with --dump')
+    parser.add_argument('--plot', action='store_true', help='also render jpg images with the npz and npy output formats')
+    parser.add_argument('--outdir', type=str, help='directory for --dump output (default the temp directory)')
+    parser.add_argument('--stream', action='store_true', help='emit JSON-lines progress events and incremental dirty images while simulating (implies --dump)')
+    parser.add_argument('--stream-every', metavar='STEPS', type=int, default=5, help='time steps between incremental dirty images with --stream')
+    parser.add_argument('--serve', action='store_true', help='serve JSON-lines simulation requests on stdin/stdout')
+    parser.add_argument('--batch', metavar='MANIFEST', type=str, help='run each JSON-lines request in this file (like --serve) in one process, printing one result record per line')
+    parser.add_argument('--sweep', metavar='SPEC', type=str, help='run every combination of the parameter values in this JSON file (see `sweep_requests`), printing one result record per line')
+    parser.add_argument('--jobs', type=int, default=1, help='number of worker processes for --batch and --sweep entries')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes for the simulation')
+    parser.add_argument('--imager', choices=aflux.IMAGING_METHODS, default='dft', help='imaging backend for the dirty image and beam')
+    parser.add_argument('--kernel', choices=aflux.GRIDDING_KERNELS, default='kaiser-bessel', help='gridding kernel for the fft imager')
+    parser.add_argument('--max-mem', type=str, help='memory budget for the dft imager, e.g. 2G (evaluates in chunks)')
+    parser.add_argument('--deconvolver', choices=aflux.DECONVOLVERS, default='hogbom', help='CLEAN algorithm')
+    parser.add_argument('--major-cycles', type=int, default=10, help='maximum major cycles for the clark and cotton-schwab deconvolvers')
+    parser.add_argument('--clean-threshold', type=float, help='stop CLEAN when the residual peak drops below this fraction of the image peak')
+    parser.add_argument('--clean-tol', type=float, help='stop CLEAN when the residual peak changes by less than this fraction')
+    parser.add_argument('--redundancy-tol', metavar='WAVELENGTHS', type=float, help='merge baselines whose (u,v) agree within this tolerance before imaging')
+    parser.add_argument('--channels', type=int, default=1, help='split the bandwidth into this many frequency channels, simulated and imaged together')
+    parser.add_argument('--precision', choices=('double', 'single'), default='double', help='floating point precision of the simulation and imaging arrays')
+    parser.add_argument('--check-precision', action='store_true', help='report the dirty image error against a double precision run on stderr')
+    parser.add_argument('--psf-cache', metavar='DIR', type=str, help='also keep dirty beams in this directory, reused by later runs with the same uv coverage')
+    parser.add_argument('--psf-cache-size', type=str, default='256M', help='maximum size of the --psf-cache directory, e.g. 1G (oldest used beams are evicted)')
+    parser.add_argument('--profile', metavar='PATH', nargs='?', const='-', help='write a JSON breakdown of the time and peak memory of each stage (and each time step with --stream) to PATH or stderr')
+    parser.add_argument('--cprofile', metavar='PATH', type=str, help='write cProfile stats of the run to PATH (see pstats)')
+    parser.add_argument('--check-imager', action='store_true', help='report the imager error against the direct DFT on stderr')
+    return parser
 
-    # parse the input json string or file
-    input_data = None
+def load_input(args):
+    """
+    Parameters
+    ----------
+    args : argparse.Namespace
+        parsed options with `json` or `file`
+
+    Returns
+    -------
+    input_data : dict | None
+        observation JSON data or None if no input was given
+    """
     if args.json:
-        input_data = json.loads(args.json)
+        return json.loads(args.json)
     elif args.file:
         with open(args.file, 'r') as f:
-            input_data = json.loads(f.read())
-    else:
-        print("No input")
-        sys.exit(1)
-        
-    wavelength = input_data['wavelength']
-    bandwidth = input_data['bandwidth']
-    samplingRate = input_data['samplingRate']
+            return json.loads(f.read())
+    return None
+
+def load_skymap(sky, image_size, interpolation='nearest', skymaps=None, rng=None):
+    """
+    Parameters
+    ----------
+    sky : str
+        "cross" | "stars" | path to FITS sky map file
+
+    image_size : int
+        image dimension for generated skies
+
+    interpolation : str
+        FITS sky map sampling
+
+    skymaps : dict | None
+        already loaded FITS sky maps to reuse, keyed by (path, interpolation)
+
+    rng : numpy.random.Generator | None
+        random generator for the star field
+
+    Returns
+    -------
+    skymap : SkyMap
+        `SkyMap` object
+    """
+    if sky == 'cross':
+        return aflux.CrossSky()
+    elif sky == 'stars':
+        return aflux.StarSky(image_size, rng)
+    if skymaps is None:
+        return aflux.FITSSkyMap(sky, interpolation)
+    key = (sky, interpolation)
+    if key not in skymaps:
+        skymaps[key] = aflux.FITSSkyMap(sky, interpolation)
+    return skymaps[key]
+
+def create_antenna_array(args, input_data, rng=None):
+    """
+    Parameters
+    ----------
+    args : argparse.Namespace
+        parsed options
 
+    input_data : dict
+        observation JSON data
+
+    rng : numpy.random.Generator | None
+        random generator for the --random array
+
+    Returns
+    -------
+    antenna_xy : ndarray
+        Jx2 matrix of antenna (x,y) positions
+
+    antenna_sizes : ndarray
+        J vector of dish sizes in meters
+
+    antenna_eta : ndarray
+        J vector of dish efficiencies
+    """
     antenna_xy = np.zeros((len(input_data['antennas']), 2))
     antenna_sizes = np.zeros(antenna_xy.shape[0])
     antenna_eta = np.zeros(antenna_xy.shape[0])
 
-    # create the antenna array
     if args.random:
-        antenna_xy = (np.random.rand(args.count, 2) - 0.5) * args.random
-        antenna_sizes[:] = args.size if args.size else 3
-        antenna_eta[:] = 0.5
+        rng = np.random.default_rng() if rng is None else rng
+        antenna_xy = (rng.random((args.count, 2)) - 0.5) * args.random
+        antenna_sizes = np.full(args.count, args.size if args.size else 3.0)
+        antenna_eta = np.full(args.count, 0.5)
     elif args.spiral:
         t = (np.arange(args.count)+1) / args.count
         logarg = t
         antenna_xy = np.zeros((args.count, 2))
         antenna_xy[:,0] = args.spiral*np.log(logarg)*np.cos(t*4*np.pi)/2
         antenna_xy[:,1] = args.spiral*np.log(logarg)*np.sin(t*4*np.pi)/2
-        antenna_sizes[:] = args.size if args.size else 3
-        antenna_eta[:] = 0.5
+        antenna_sizes = np.full(args.count, args.size if args.size else 3.0)
+        antenna_eta = np.full(args.count, 0.5)
     else:
         for i, a in enumerate(input_data['antennas']):
             antenna_xy[i,0] = a['x']
@@ -70,18 +177,252 @@ def main():
             antenna_sizes[i] = a['size']
             antenna_eta[i] = a['eta']
 
+    return antenna_xy, antenna_sizes, antenna_eta
+
+DURATION_STEP = 0.1 # 6 minutes
+
+def save_layout(path, input_data, antenna_xy, antenna_sizes, antenna_eta):
+    """
+    Save the observation with a generated array, for later --file runs.
+
+    Parameters
+    ----------
+    path : str
+        output JSON path
+
+    input_data : dict
+        observation JSON data, whose antennas are replaced in place
+
+    antenna_xy, antenna_sizes, antenna_eta : ndarray
+        generated array (see `create_antenna_array`)
+    """
+    input_data['antennas'] = list(map(
+        lambda axy: {
+            'x': float(axy[0]),
+            'y': float(axy[1]),
+            'size': float(antenna_sizes[0]),
+            'eta': float(antenna_eta[0])
+        },
+        antenna_xy
+    ))
+    with open(path, 'w') as f:
+        f.write(json.dumps(input_data, sort_keys=True, indent=2))
+
+def optimize_layout(args, input_data):
+    """
+    Score random candidate layouts by the dirty beams of their uv tracks,
+    gridded and transformed in batches instead of simulated.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        parsed options with `optimize`, `optimize_metric`, `random`, 
+        `count`, `size`, `seed`, `duration`, `kernel` and `save`
+
+    input_data : dict
+        observation JSON data
+
+    Returns
+    -------
+    out : dict
+        number of candidates, index, metrics and antennas of the best 
+        layout, and the --save path
+    """
+    rng = np.random.default_rng(args.seed)
+    size = args.size if args.size else 3
+    wavelength = input_data['wavelength']
+    duration = args.duration if args.duration else input_data['duration']
+    elapsed_steps = np.arange(0, duration, DURATION_STEP)
+    # the same distribution as the --random array
+    layouts = (rng.random((args.optimize, args.count, 2)) - 0.5) * args.random
+    beamwidth = aflux.parabolic_beamwidth(size, wavelength, degrees=True)
+    image_size = 64
+
+    # the metrics of the dirty beam run_observation would compute
+    metrics = aflux.score_layouts(layouts, elapsed_steps, wavelength, beamwidth*2, image_size*2, kernel=args.kernel)
+    score = -metrics['fill'] if args.optimize_metric == 'fill' else metrics[args.optimize_metric]
+    best = int(np.argmin(score))
+
+    antenna_xy = layouts[best]
+    antenna_sizes = np.full(args.count, size)
+    antenna_eta = np.full(args.count, 0.5)
+    if args.save:
+        save_layout(args.save, input_data, antenna_xy, antenna_sizes, antenna_eta)
+    return {
+        'candidates': args.optimize,
+        'best': best,
+        'metrics': {name: float(values[best]) for name, values in metrics.items()},
+        'antennas': [{'x': float(x), 'y': float(y)} for (x, y) in antenna_xy],
+        'savePath': args.save,
+    }
+
+def write_stream_image(image, outdir=None):
+    """
+    Parameters
+    ----------
+    image : ndarray
+        incremental dirty image
+
+    outdir : str | None
+        directory for the image (default the temp directory)
+
+    Returns
+    -------
+    path : str
+        path of the npy file, replaced atomically so readers never see 
+        a partial image
+    """
+    outdir = outdir if outdir else tempfile.gettempdir()
+    path = os.path.join(outdir, 'streamImage.npy')
+    partial = os.path.join(outdir, 'streamImage.partial.npy')
+    np.save(partial, np.abs(image))
+    os.replace(partial, path)
+    return path
+
+def stream_track(args, elapsed_steps, imager, emit, **track_kwargs):
+    """
+    Simulate the time steps in order, adding each step to the dirty 
+    image as it arrives.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        parsed options with `stream_every`, `workers`, `outdir` and
+        `redundancy_tol`
+
+    elapsed_steps : ndarray
+        T vector of elapsed hours
+
+    imager : aflux.IncrementalImager
+        dirty image to update
+
+    emit : callable
+        called with each progress event dict
+
+    track_kwargs :
+        simulation options for `aflux.iter_track`
+
+    Returns
+    -------
+    track_uv : ndarray
+        T x B x 2 (or T x C x B x 2) array of unique baselines
+
+    track_xcorr : ndarray
+        T x B (or T x C x B) array of cross correlations
+
+    zero_spacing : float
+        sum of the autocorrelations
+
+    pixeldata : ndarray
+        sampled sky pixel values
+    """
+    T = len(elapsed_steps)
+    every = max(1, args.stream_every)
+    uv_steps, xcorr_steps = [], []
+    for steps, uv, xcorr, signals, pixeldata in aflux.iter_track(elapsed=elapsed_steps, workers=args.workers, **track_kwargs):
+        step = steps[-1] + 1
+        uv_steps.append(uv)
+        xcorr_steps.append(xcorr)
+        uv, xcorr, weights = uv.reshape(-1, 2), xcorr.reshape(-1), None
+        with aflux.PROFILER.step(int(steps[0])):
+            if args.redundancy_tol:
+                uv, xcorr, weights = aflux.average_redundant_baselines(uv, xcorr, args.redundancy_tol, hermitian=True)
+            imager.add(uv, xcorr, aflux.autocorrelation_sum(signals), weights)
+        emit({'event': 'step', 'step': int(step), 'steps': T, 'elapsed': round(float(elapsed_steps[step - 1]), 6)})
+        if step % every == 0 or step == T:
+            emit({
+                'event': 'image', 
+                'step': int(step), 
+                'steps': T, 
+                'path': write_stream_image(imager.image(), args.outdir)
+            })
+    return np.concatenate(uv_steps), np.concatenate(xcorr_steps), imager.zero_spacing, pixeldata
+
+# complex dtype for each --precision
+PRECISION_DTYPES = {'double': np.complex128, 'single': np.complex64}
+
+def double_precision_image(args, elapsed_steps, track_kwargs, imwidth, image_size, imager_opts):
+    """
+    Parameters
+    ----------
+    args : argparse.Namespace
+        parsed options
+
+    elapsed_steps : ndarray
+        T vector of elapsed hours
+
+    track_kwargs : dict
+        simulation options for `aflux.simulate_track`
+
+    imwidth : float
+        image beamwidth in degrees
+
+    image_size : int
+        samples per dimension of the image
+
+    imager_opts : dict
+        extra options for the imaging backend
+
+    Returns
+    -------
+    image : ndarray
+        dirty image of the same observation simulated and imaged in
+        double precision
+    """
+    track_uv, track_xcorr, signals, _ = aflux.simulate_track(
+        elapsed=elapsed_steps, 
+        workers=args.workers, 
+        **dict(track_kwargs, dtype=np.complex128)
+    )
+    all_uv, all_xcorr, weights = track_uv.reshape(-1, 2), track_xcorr.reshape(-1), None
+    if args.redundancy_tol:
+        all_uv, all_xcorr, weights = aflux.average_redundant_baselines(all_uv, all_xcorr, args.redundancy_tol, hermitian=True)
+    return aflux.compute_dirty_image(
+        all_uv, 
+        all_xcorr, 
+        imwidth, 
+        image_size, 
+        args.imager, 
+        hermitian=True, 
+        zero_spacing=aflux.autocorrelation_sum(signals), 
+        weights=weights, 
+        **dict(imager_opts, dtype=np.complex128)
+    )
+
+def run_observation(args, input_data, skymaps=None, emit=None):
+    """
+    Parameters
+    ----------
+    args : argparse.Namespace
+        parsed options
+
+    input_data : dict
+        observation JSON data
+
+    skymaps : dict | None
+        already loaded FITS sky maps to reuse (see `load_skymap`)
+
+    emit : callable | None
+        called with progress event dicts when streaming (see `stream_track`)
+
+    Returns
+    -------
+    results : dict
+        simulated arrays and images
+    """
+    wavelength = input_data['wavelength']
+    bandwidth = input_data['bandwidth']
+    samplingRate = input_data['samplingRate']
+
+    # the noise gets its own streams from the same seed (see `aflux.noise_seeds`);
+    # a seed is picked here when none is given so --check-precision sees the same noise
+    seed = args.seed if args.seed is not None else np.random.SeedSequence().entropy
+    rng = np.random.default_rng(seed)
+
+    antenna_xy, antenna_sizes, antenna_eta = create_antenna_array(args, input_data, rng)
+
     if args.save:
-        input_data['antennas'] = list(map(
-            lambda axy: {
-                'x': axy[0],
-                'y': axy[1],
-                'size': antenna_sizes[0],
-                'eta': antenna_eta[0]
-            },
-            antenna_xy
-        ))
-        with open(args.save, 'w') as f:
-            f.write(json.dumps(input_data, sort_keys=True, indent=2))
+        save_layout(args.save, input_data, antenna_xy, antenna_sizes, antenna_eta)
 
     observation = aflux.Observation(
         input_data['target']['ra'],
@@ -92,83 +433,169 @@ def main():
         args.duration if args.duration else input_data['duration']
     )
 
-    DURATION_STEP = 0.1 # 6 minutes
-
     image_size = 64
 
     # create the desired skymap
-    skymap = None
-    if args.sky == 'cross':
-        skymap = aflux.CrossSky()
-    elif args.sky == 'stars':
-        skymap = aflux.StarSky(image_size)
-    else:
-        skymap = aflux.FITSSkyMap(args.sky)
+    skymap = load_skymap(args.sky, image_size, args.interpolation, skymaps, rng)
+
+    # channel wavelengths across the band; the antenna beams use the center wavelength
+    wavelengths = aflux.channel_wavelengths(wavelength, bandwidth, args.channels) if args.channels > 1 else wavelength
 
     # figure out the beamwidths of each antenna
     beamwidths = aflux.parabolic_beamwidth(antenna_sizes, wavelength, degrees=True)
 
-    image = np.zeros((image_size, image_size), dtype=complex)
-    all_uv = []
-    all_xcorr = []
-    for elapsed in np.arange(0, observation.duration, DURATION_STEP):
-        current_xy = aflux.propagate_antennas(antenna_xy, elapsed)
-        current_uv = aflux.to_uv(current_xy, wavelength)
-        all_uv.append(current_uv)
-        signals = []
-        if args.fast:
-            signals, pixeldata = aflux.simulate(
-                observation, 
-                current_xy, 
-                beamwidths[0],
-                wavelength, 
-                skymap,
-                samples_per_dim=image_size,
-                snr=args.snr,
-                samples=args.samples if args.samples else 1
-            )
-        else:
-            for (axy, bw, eta) in zip(current_xy, beamwidths, antenna_eta):
-                axy = np.expand_dims(axy, axis=0)
-                rx, pixeldata = aflux.simulate(
-                    observation, 
-                    axy, 
-                    bw,
-                    wavelength, 
-                    skymap,
-                    samples_per_dim=image_size,
-                    snr=args.snr,
-                    samples=args.samples if args.samples else 1
-                )
-                signals.append(rx)
-            signals = np.stack(signals, axis=0)
-
-        xcorr = aflux.xcorr_signals(signals)
-        all_xcorr.append(xcorr.reshape(-1))
-        
-    all_xcorr = np.concatenate(all_xcorr)
-    all_uv = np.concatenate(all_uv, axis=0)
+    dtype = PRECISION_DTYPES[args.precision]
+    imager_opts = {'dtype': dtype}
+    if args.imager == 'fft':
+        imager_opts['kernel'] = args.kernel
+    elif args.max_mem:
+        imager_opts['max_mem'] = args.max_mem
+
+    elapsed_steps = np.arange(0, observation.duration, DURATION_STEP)
+    track_kwargs = {
+        'observation': observation, 
+        'antenna_xy': antenna_xy, 
+        'beamwidth': beamwidths[0] if args.fast else beamwidths, 
+        'wavelength': wavelengths, 
+        'skymap': skymap, 
+        'samples_per_dim': image_size,
+        'snr': args.snr,
+        'samples': args.samples if args.samples else 1,
+        'group_beams': args.group_beams,
+        'unique': True,
+        'dtype': dtype,
+        'seed': seed,
+    }
+    if emit is not None:
+        # the dirty image is built up step by step while simulating
+        imager = aflux.IncrementalImager(np.amax(beamwidths), image_size, args.imager, hermitian=True, **imager_opts)
+        track_uv, track_xcorr, zero_spacing, pixeldata = stream_track(args, elapsed_steps, imager, emit, **track_kwargs)
+        image = imager.image()
+    else:
+        track_uv, track_xcorr, signals, pixeldata = aflux.simulate_track(
+            elapsed=elapsed_steps, 
+            workers=args.workers, 
+            **track_kwargs
+        )
+        zero_spacing = aflux.autocorrelation_sum(signals)
+
+    current_uv = track_uv[-1].reshape(-1, 2)
+    all_uv = track_uv.reshape(-1, 2)
+    all_xcorr = track_xcorr.reshape(-1)
+
+    # merge redundant baselines so imaging scales with the distinct ones
+    weights = None
+    if args.redundancy_tol:
+        visibilities = all_uv.shape[0]
+        all_uv, all_xcorr, weights = aflux.average_redundant_baselines(
+            all_uv, 
+            all_xcorr, 
+            args.redundancy_tol, 
+            hermitian=True
+        )
+        print('baseline averaging: {} -> {} visibilities ({:.2f}x)'.format(
+            visibilities, 
+            all_uv.shape[0], 
+            visibilities / all_uv.shape[0]
+        ), file=sys.stderr)
+
+    # only the unique baselines are kept; imaging adds their conjugates 
+    # and the autocorrelations (zero spacing) back analytically
+    hermitian_opts = {'hermitian': True, 'zero_spacing': zero_spacing, 'weights': weights}
 
     # find the dirty image
-    image = aflux.compute_dirty_image(
-        all_uv, 
-        all_xcorr, 
-        np.amax(beamwidths), 
-        samples_per_dim=image_size
-    )
+    if emit is None:
+        image = aflux.compute_dirty_image(
+            all_uv, 
+            all_xcorr, 
+            np.amax(beamwidths), 
+            samples_per_dim=image_size,
+            method=args.imager,
+            **hermitian_opts,
+            **imager_opts
+        )
+
+    if args.check_imager:
+        errors = aflux.check_imager(
+            all_uv, 
+            all_xcorr, 
+            np.amax(beamwidths), 
+            image_size, 
+            method=args.imager,
+            **hermitian_opts,
+            **imager_opts
+        )
+        print('imager "{}" vs dft: {}'.format(args.imager, json.dumps(errors)), file=sys.stderr)
+
+    if args.check_precision:
+        reference = double_precision_image(args, elapsed_steps, track_kwargs, np.amax(beamwidths), image_size, imager_opts)
+        errors = aflux.image_error(reference, image)
+        print('precision "{}" vs double: {}'.format(args.precision, json.dumps(errors)), file=sys.stderr)
 
     # figure out the estimated synthetic beamwidth
     norms = current_uv.dot(current_uv.T)
     max_baseline = np.sqrt(np.amax(norms))*wavelength
     synthetic_bw = aflux.parabolic_beamwidth(max_baseline, wavelength, degrees=True)
 
-    # find the dirty beam
-    dirty_beam = aflux.dirty_beam(all_uv, np.amax(beamwidths)*2, image_size*2)
+    # find the dirty beam; the in-memory cache is shared by the runs of a server
+    if emit is not None:
+        emit({'event': 'stage', 'stage': 'dirty_beam'})
+    aflux.PSF_CACHE.directory = args.psf_cache
+    aflux.PSF_CACHE.max_bytes = aflux.parse_memory_size(args.psf_cache_size)
+    dirty_beam = aflux.dirty_beam(
+        all_uv, 
+        np.amax(beamwidths)*2, 
+        image_size*2, 
+        args.imager, 
+        hermitian=True, 
+        zero_spacing=len(elapsed_steps)*args.channels*antenna_xy.shape[0], 
+        weights=weights,
+        **imager_opts
+    )
     
     # CLEAN
+    if emit is not None:
+        emit({'event': 'stage', 'stage': 'clean'})
     lmbda = 0.05
     iters = 1000
-    cleaned = aflux.clean(image, all_uv, np.amax(beamwidths), synthetic_bw, iters, lmbda)
+    if args.deconvolver == 'hogbom':
+        cleaned = aflux.clean(
+            image, 
+            all_uv, 
+            np.amax(beamwidths), 
+            synthetic_bw, 
+            iters, 
+            lmbda, 
+            psf=dirty_beam, 
+            threshold=args.clean_threshold, 
+            tol=args.clean_tol
+        )
+    else:
+        if args.deconvolver == 'clark':
+            components, _ = aflux.clark_clean(
+                image, 
+                dirty_beam, 
+                lmbda, 
+                iters, 
+                args.clean_threshold, 
+                cycles=args.major_cycles
+            )
+        else:
+            components, _ = aflux.cotton_schwab_clean(
+                all_uv, 
+                all_xcorr, 
+                np.amax(beamwidths), 
+                image_size, 
+                lmbda, 
+                iters, 
+                args.clean_threshold, 
+                cycles=args.major_cycles, 
+                method=args.imager, 
+                hermitian=True,
+                weights=weights,
+                **imager_opts
+            )
+        cleaned = np.abs(aflux.restore(components, np.amax(beamwidths), synthetic_bw))
     image = np.abs(image)
 
     # ---- COMPARISON ---- #
@@ -191,90 +618,592 @@ def main():
     # plt.subplot(224)
     # plt.imshow(np.abs(clnd), cmap='gray')
     # -------------------- #
-    
-    if args.dump:
-        outdir = tempfile.gettempdir()
-        out = {
-            'cleanPath': os.path.join(outdir, 'clean.jpg'),
-            'skyPath': os.path.join(outdir, 'sky.jpg'),
-            'dirtyBeamPath': os.path.join(outdir, 'dirtyBeam.jpg'),
-            'dirtyImagePath': os.path.join(outdir, 'dirtyImage.jpg'),
-            'uvPath': os.path.join(outdir, 'uv.jpg'),
-        }
-        plt.figure()
-        plt.imshow(pixeldata.reshape(image_size,image_size), cmap='gray')
-        plt.axis('off')
-        plt.title('Source Image')
-        plt.savefig(out['skyPath'])
-
-        plt.imshow(cleaned, cmap='gray')
-        plt.title('CLEANed Image')
-        plt.axis('off')
-        plt.savefig(out['cleanPath'])
-
-        plt.imshow(image, cmap='gray')
-        plt.title('Dirty Image')
-        plt.axis('off')
-        plt.savefig(out['dirtyImagePath'])
-
-        plt.imshow(dirty_beam, cmap='gray')
-        plt.title('Dirty Beam')
-        plt.axis('off')
-        plt.savefig(out['dirtyBeamPath'])
-        plt.figure()
-        ax = plt.gca()
-        plt.scatter(all_uv[:,0], all_uv[:,1], color='k', marker='.')
-        plt.title('uv Plane')
-        ax.set_aspect('equal')
-        plt.title('uv Plane')
-        plt.xlabel('u [wavelengths]')
-        plt.ylabel('v [wavelengths]')
-        ax.grid()
-        plt.savefig(out['uvPath'])
-        print(json.dumps(out))
+
+    return {
+        'antenna_xy': antenna_xy,
+        'beamwidths': beamwidths,
+        'image_size': image_size,
+        'iters': iters,
+        'lmbda': lmbda,
+        'pixeldata': pixeldata,
+        'image': image,
+        'cleaned': cleaned,
+        'dirty_beam': dirty_beam,
+        'all_uv': all_uv,
+        'all_xcorr': all_xcorr,
+        'baselines': aflux.baseline_pairs(antenna_xy.shape[0]),
+        'zero_spacing': zero_spacing,
+        'weights': np.ones(all_uv.shape[0]) if weights is None else weights,
+    }
+
+@aflux.PROFILER.timed('plotting')
+def dump_results(results, outdir=None):
+    """
+    Parameters
+    ----------
+    results : dict
+        output of `run_observation`
+
+    outdir : str | None
+        directory for the images (default the temp directory)
+
+    Returns
+    -------
+    out : dict
+        paths of the rendered images
+    """
+    image_size = results['image_size']
+    pixeldata = results['pixeldata']
+    image = results['image']
+    cleaned = results['cleaned']
+    dirty_beam = results['dirty_beam']
+    all_uv = results['all_uv']
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    outdir = outdir if outdir else tempfile.gettempdir()
+    out = {
+        'cleanPath': os.path.join(outdir, 'clean.jpg'),
+        'skyPath': os.path.join(outdir, 'sky.jpg'),
+        'dirtyBeamPath': os.path.join(outdir, 'dirtyBeam.jpg'),
+        'dirtyImagePath': os.path.join(outdir, 'dirtyImage.jpg'),
+        'uvPath': os.path.join(outdir, 'uv.jpg'),
+    }
+    plt.figure()
+    plt.imshow(pixeldata.reshape(image_size,image_size), cmap='gray')
+    plt.axis('off')
+    plt.title('Source Image')
+    plt.savefig(out['skyPath'])
+
+    plt.imshow(cleaned, cmap='gray')
+    plt.title('CLEANed Image')
+    plt.axis('off')
+    plt.savefig(out['cleanPath'])
+
+    plt.imshow(image, cmap='gray')
+    plt.title('Dirty Image')
+    plt.axis('off')
+    plt.savefig(out['dirtyImagePath'])
+
+    plt.imshow(dirty_beam, cmap='gray')
+    plt.title('Dirty Beam')
+    plt.axis('off')
+    plt.savefig(out['dirtyBeamPath'])
+    plt.figure()
+    ax = plt.gca()
+    plt.scatter(all_uv[:,0], all_uv[:,1], color='k', marker='.')
+    plt.scatter(-all_uv[:,0], -all_uv[:,1], color='k', marker='.')
+    plt.title('uv Plane')
+    ax.set_aspect('equal')
+    plt.title('uv Plane')
+    plt.xlabel('u [wavelengths]')
+    plt.ylabel('v [wavelengths]')
+    ax.grid()
+    plt.savefig(out['uvPath'])
+    plt.close('all')
+    return out
+
+# arrays written by `save_arrays`
+# (all_uv and all_xcorr hold the unique baselines of each time step in turn,
+# with the antenna indices in baselines, or the merged baselines with 
+# --redundancy-tol)
+RESULT_ARRAYS = ('pixeldata', 'image', 'cleaned', 'dirty_beam', 'all_uv', 'all_xcorr', 'baselines', 'zero_spacing', 'weights')
+
+@aflux.PROFILER.timed('save')
+def save_arrays(results, fmt='npz', outdir=None):
+    """
+    Parameters
+    ----------
+    results : dict
+        output of `run_observation`
+
+    fmt : str
+        "npz" for one archive or "npy" for one raw array file per 
+        result that can be memory-mapped (`np.load(path, mmap_mode='r')`)
+
+    outdir : str | None
+        directory for the arrays (default the temp directory)
+
+    Returns
+    -------
+    out : dict
+        "npzPath" with the archive path, or "arrayPaths" mapping 
+        each array name to its file
+    """
+    outdir = outdir if outdir else tempfile.gettempdir()
+    if fmt == 'npz':
+        path = os.path.join(outdir, 'astroflux.npz')
+        np.savez(path, **{name: results[name] for name in RESULT_ARRAYS})
+        return {'npzPath': path}
+    paths = {}
+    for name in RESULT_ARRAYS:
+        paths[name] = os.path.join(outdir, name + '.npy')
+        np.save(paths[name], np.ascontiguousarray(results[name]))
+    return {'arrayPaths': paths}
+
+def write_results(args, results):
+    """
+    Parameters
+    ----------
+    args : argparse.Namespace
+        parsed options with `output_format`, `plot` and `outdir`
+
+    results : dict
+        output of `run_observation`
+
+    Returns
+    -------
+    out : dict
+        manifest of the written files
+    """
+    out = {}
+    if args.output_format == 'jpg' or args.plot:
+        out.update(dump_results(results, args.outdir))
+    if args.output_format != 'jpg':
+        out.update(save_arrays(results, args.output_format, args.outdir))
+    return out
+
+@aflux.PROFILER.timed('plotting')
+def show_results(results):
+    """
+    Parameters
+    ----------
+    results : dict
+        output of `run_observation`
+    """
+    image_size = results['image_size']
+    pixeldata = results['pixeldata']
+    image = results['image']
+    cleaned = results['cleaned']
+    dirty_beam = results['dirty_beam']
+    all_uv = results['all_uv']
+    antenna_xy = results['antenna_xy']
+    beamwidths = results['beamwidths']
+    iters = results['iters']
+    lmbda = results['lmbda']
+    import matplotlib.pyplot as plt
+    # visualizations
+    plt.figure(figsize=(10,10))
+    ax = plt.subplot(231)
+    plt.scatter(antenna_xy[:,0], antenna_xy[:,1], color='k', marker='x')
+    ax.set_aspect('equal')
+    plt.title('xy Plane')
+    plt.xlabel('x [meters]')
+    plt.ylabel('y [meters]')
+    ax.grid()
+    ax = plt.subplot(232)
+    plt.scatter(all_uv[:,0], all_uv[:,1], color='k', marker='.')
+    plt.scatter(-all_uv[:,0], -all_uv[:,1], color='k', marker='.')
+    ax.set_aspect('equal')
+    plt.title('uv Plane')
+    plt.xlabel('u [wavelengths]')
+    plt.ylabel('v [wavelengths]')
+    ax.grid()
+    plt.subplot(233)
+    plt.imshow(pixeldata.reshape(image_size,image_size), cmap='gray')
+    plt.title('Source Image (BW = {:.1f} deg)'.format(np.amax(beamwidths)))
+    plt.xlabel('Azimuth')
+    plt.ylabel('Altitude')
+    plt.axis('off')
+    plt.subplot(234)
+    plt.imshow(np.abs(dirty_beam), cmap='gray')
+    plt.axis('off')
+    plt.title('Dirty Beam (BW = {:.1f} deg)'.format(np.amax(beamwidths)*2))
+    plt.xlabel('Azimuth')
+    plt.ylabel('Altitude')
+    plt.subplot(235)
+    plt.imshow(np.abs(image), cmap='gray')
+    plt.axis('off')
+    plt.title('Dirty Image (BW = {:.1f} deg)'.format(np.amax(beamwidths)))
+    plt.xlabel('Azimuth')
+    plt.ylabel('Altitude')
+    plt.subplot(236)
+    plt.imshow(np.abs(cleaned), cmap='gray')
+    plt.axis('off')
+    plt.title('CLEANed ({:d} iters, lambda={:.2f})'.format(iters, lmbda))
+    plt.xlabel('Azimuth')
+    plt.ylabel('Altitude')
+    plt.tight_layout(pad=4.0)
+    plt.show()
+
+def event_writer(outstream, **fields):
+    """
+    Parameters
+    ----------
+    outstream : file
+        stream for the JSON-lines events
+
+    fields :
+        extra fields added to every event (e.g. the request "id")
+
+    Returns
+    -------
+    emit : callable
+        writes and flushes one event dict per line
+    """
+    def emit(event):
+        event = dict(fields, **event)
+        outstream.write(json.dumps(event) + '\n')
+        outstream.flush()
+    return emit
+
+def serve(skymaps=None, instream=sys.stdin, outstream=sys.stdout):
+    """
+    Answer simulation requests until the input closes. Each input line is
+    a JSON object with an "observation" (the observation JSON data) and 
+    optional "args" (a list of command line options) and "id". Each
+    request gets one output line with the same "id" and either a 
+    "result" (as printed by --dump) or an "error" message. Requests with
+    --stream also get "event" lines with the same "id" before the result.
+
+    Parameters
+    ----------
+    skymaps : dict | None
+        FITS sky maps kept loaded between requests (see `load_skymap`)
+    """
+    skymaps = {} if skymaps is None else skymaps
+    parser = build_parser(add_help=False)
+    for line in iter(instream.readline, ''):
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            request = None
+            response = {'id': None, 'error': '{}: {}'.format(type(e).__name__, e)}
+        if request is not None:
+            response = answer_request(parser, request, skymaps, outstream)
+        outstream.write(json.dumps(response) + '\n')
+        outstream.flush()
+
+def answer_request(parser, request, skymaps=None, outstream=None):
+    """
+    Parameters
+    ----------
+    parser : argparse.ArgumentParser
+        parser for the request options (see `build_parser`)
+
+    request : object
+        decoded request line, a dict with "observation", "args" and "id"
+        (see `serve`)
+
+    skymaps : dict | None
+        FITS sky maps kept loaded between requests (see `load_skymap`)
+
+    outstream : file | None
+        stream for the --stream events of the request, or None to not 
+        stream them
+
+    Returns
+    -------
+    response : dict
+        the request "id" and either a "result" or an "error"
+    """
+    response = {'id': None}
+    # argparse writes usage and errors to the console, which must stay JSON lines
+    messages = io.StringIO()
+    try:
+        if not isinstance(request, dict):
+            raise ValueError('request must be a JSON object')
+        response['id'] = request.get('id')
+        with contextlib.redirect_stdout(messages), contextlib.redirect_stderr(messages):
+            args = parser.parse_args(request.get('args', []))
+        input_data = request.get('observation') or load_input(args)
+        if input_data is None or not args.sky:
+            raise ValueError('request needs an observation and --sky')
+        if args.profile or args.cprofile:
+            raise ValueError('--profile and --cprofile are not supported for requests')
+        emit = event_writer(outstream, id=response['id']) if args.stream and outstream is not None else None
+        results = run_observation(args, input_data, skymaps, emit)
+        response['result'] = write_results(args, results)
+    except SystemExit:
+        lines = messages.getvalue().strip().splitlines()
+        response['error'] = 'invalid arguments' + (': ' + lines[-1] if lines else '')
+    except Exception as e:
+        response['error'] = '{}: {}'.format(type(e).__name__, e)
+    return response
+
+# options that choose the batch mode itself, not passed on to the entries
+BATCH_OPTIONS = ('--batch', '--sweep', '--jobs')
+
+def entry_defaults(argv):
+    """
+    Parameters
+    ----------
+    argv : list
+        command line options of a --batch or --sweep run
+
+    Returns
+    -------
+    argv : list
+        the options without `BATCH_OPTIONS`, shared by every entry
+    """
+    shared = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in BATCH_OPTIONS:
+            skip = True
+        elif not arg.startswith(tuple(option + '=' for option in BATCH_OPTIONS)):
+            shared.append(arg)
+    return shared
+
+def set_field(data, path, value):
+    """
+    Parameters
+    ----------
+    data : dict
+        observation JSON data, updated in place
+
+    path : str
+        dotted field path, e.g. "target.ra"
+
+    value : object
+        new field value
+    """
+    keys = path.split('.')
+    for key in keys[:-1]:
+        data = data.setdefault(key, {})
+    data[keys[-1]] = value
+
+def option_args(option, value):
+    """
+    Returns
+    -------
+    args : list
+        command line arguments setting `option` to `value`; flags are 
+        given for true values and left out for false ones
+    """
+    if value is True:
+        return [option]
+    if value is False or value is None:
+        return []
+    return [option, str(value)]
+
+def sweep_requests(spec, observation=None):
+    """
+    Parameters
+    ----------
+    spec : dict
+        a "sweep" object of parameter names to lists of values, and an 
+        optional base "observation" and "args". Names starting with "--"
+        are command line options (e.g. "--snr"), the others are dotted 
+        observation fields (e.g. "target.ra" or "antennas")
+
+    observation : dict | None
+        base observation when the spec has none
+
+    Returns
+    -------
+    requests : list
+        one request (see `serve`) per combination of the parameter 
+        values, with the values under "params"
+    """
+    base = spec.get('observation', observation)
+    names = list(spec['sweep'])
+    requests = []
+    for index, values in enumerate(itertools.product(*(spec['sweep'][name] for name in names))):
+        data = copy.deepcopy(base)
+        args = list(spec.get('args', []))
+        for name, value in zip(names, values):
+            if name.startswith('--'):
+                args.extend(option_args(name, value))
+            else:
+                set_field(data, name, value)
+        requests.append({'id': index, 'observation': data, 'args': args, 'params': dict(zip(names, values))})
+    return requests
+
+def load_batch(parser, args):
+    """
+    Parameters
+    ----------
+    parser : argparse.ArgumentParser
+        command line parser, for reporting a sweep without an observation
+
+    args : argparse.Namespace
+        parsed options with `batch` or `sweep`
+
+    Returns
+    -------
+    entries : list
+        (request, error) pairs for the manifest lines, or for the 
+        requests of the sweep; lines that are not JSON objects get an 
+        "id" of their line index and an error message
+    """
+    if args.sweep:
+        with open(args.sweep, 'r') as f:
+            spec = json.loads(f.read())
+        observation = load_input(args)
+        if spec.get('observation') is None and observation is None:
+            parser.error('--sweep needs a base observation, in the spec or with --json or --file')
+        return [(request, None) for request in sweep_requests(spec, observation)]
+    entries = []
+    with open(args.batch, 'r') as f:
+        for index, line in enumerate(f):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                entries.append(({'id': index}, '{}: {}'.format(type(e).__name__, e)))
+                continue
+            if not isinstance(request, dict):
+                entries.append(({'id': index}, 'ValueError: request must be a JSON object'))
+                continue
+            request.setdefault('id', index)
+            entries.append((request, None))
+    return entries
+
+# the parser and loaded FITS sky maps of each batch worker process
+_batch_state = {}
+
+def _init_batch_worker():
+    _batch_state['parser'] = build_parser(add_help=False)
+    _batch_state['skymaps'] = {}
+
+def _batch_task(request):
+    return answer_request(_batch_state['parser'], request, _batch_state['skymaps'])
+
+def entry_dirname(request_id):
+    """
+    Returns
+    -------
+    name : str
+        the request id as a single directory name, with path separators
+        and other unsafe characters replaced
+    """
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', str(request_id)).lstrip('.')
+    return name or '_'
+
+def run_batch(parser, args, argv, outstream=sys.stdout):
+    """
+    Run the --batch or --sweep entries, each in its own output directory,
+    sharing the loaded sky maps and the library caches of each process.
+
+    Parameters
+    ----------
+    parser : argparse.ArgumentParser
+        command line parser (see `load_batch`)
+
+    args : argparse.Namespace
+        parsed options with `batch` or `sweep`, `jobs` and `outdir`
+        (default a new temporary directory)
+
+    argv : list
+        command line options, whose non-batch options are the defaults 
+        of every entry
+
+    outstream : file
+        stream for the result records, one JSON line per entry in order;
+        entries that cannot run (invalid lines, or ids that map to the 
+        output directory of an earlier entry) get an "error" record
+    """
+    shared = entry_defaults(argv)
+    outdir = args.outdir if args.outdir else tempfile.mkdtemp(prefix='astroflux-batch-')
+    entries = []
+    dirnames = set()
+    for request, error in load_batch(parser, args):
+        if error is None:
+            dirname = entry_dirname(request['id'])
+            if dirname in dirnames:
+                error = 'ValueError: id {} has the output directory of an earlier entry'.format(json.dumps(request['id']))
+            else:
+                dirnames.add(dirname)
+                entry_dir = os.path.join(outdir, dirname)
+                os.makedirs(entry_dir, exist_ok=True)
+                # the entry's own options come last, so they override the shared ones
+                request = dict(request, args=shared + list(request.get('args', [])) + ['--outdir', entry_dir])
+        entries.append((request, error))
+    requests = [request for request, error in entries if error is None]
+    if args.jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(args.jobs, initializer=_init_batch_worker)
+        responses = pool.map(_batch_task, requests)
+    else:
+        pool = None
+        _init_batch_worker()
+        responses = map(_batch_task, requests)
+    try:
+        for request, error in entries:
+            response = next(responses) if error is None else {'id': request['id'], 'error': error}
+            if 'params' in request:
+                response['params'] = request['params']
+            outstream.write(json.dumps(response) + '\n')
+            outstream.flush()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+def write_profile(report, path):
+    """
+    Parameters
+    ----------
+    report : dict
+        stage timings (see `aflux.StageProfiler.report`)
+
+    path : str
+        output JSON path, or "-" for stderr
+    """
+    if path == '-':
+        print(json.dumps(report, indent=2), file=sys.stderr)
+    else:
+        with open(path, 'w') as f:
+            f.write(json.dumps(report, indent=2))
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+
+    if args.serve and (args.profile or args.cprofile):
+        parser.error('--profile and --cprofile are not supported with --serve')
+    if args.serve:
+        serve()
+        return
+
+    if (args.batch or args.sweep) and (args.profile or args.cprofile):
+        parser.error('--profile and --cprofile are not supported with --batch or --sweep')
+    if args.batch or args.sweep:
+        run_batch(parser, args, sys.argv[1:])
+        return
+
+    if args.optimize and not (args.random and args.count):
+        parser.error('--optimize needs --random and --count')
+    if not args.sky and not args.optimize:
+        parser.error('the following arguments are required: --sky')
+
+    # parse the input json string or file
+    input_data = load_input(args)
+    if input_data is None:
+        print("No input")
+        sys.exit(1)
+
+    if args.optimize:
+        print(json.dumps(optimize_layout(args, input_data)))
+        return
+
+    if args.profile:
+        aflux.PROFILER.enable(memory=True)
+    if args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    emit = event_writer(sys.stdout) if args.stream else None
+    results = run_observation(args, input_data, emit=emit)
+    if args.stream:
+        emit({'event': 'result', 'result': write_results(args, results)})
+    elif args.dump:
+        print(json.dumps(write_results(args, results)))
     else:
-        # visualizations
-        plt.figure(figsize=(10,10))
-        ax = plt.subplot(231)
-        plt.scatter(antenna_xy[:,0], antenna_xy[:,1], color='k', marker='x')
-        ax.set_aspect('equal')
-        plt.title('xy Plane')
-        plt.xlabel('x [meters]')
-        plt.ylabel('y [meters]')
-        ax.grid()
-        ax = plt.subplot(232)
-        plt.scatter(all_uv[:,0], all_uv[:,1], color='k', marker='.')
-        ax.set_aspect('equal')
-        plt.title('uv Plane')
-        plt.xlabel('u [wavelengths]')
-        plt.ylabel('v [wavelengths]')
-        ax.grid()
-        plt.subplot(233)
-        plt.imshow(pixeldata.reshape(image_size,image_size), cmap='gray')
-        plt.title('Source Image (BW = {:.1f} deg)'.format(np.amax(beamwidths)))
-        plt.xlabel('Azimuth')
-        plt.ylabel('Altitude')
-        plt.axis('off')
-        plt.subplot(234)
-        plt.imshow(np.abs(dirty_beam), cmap='gray')
-        plt.axis('off')
-        plt.title('Dirty Beam (BW = {:.1f} deg)'.format(np.amax(beamwidths)*2))
-        plt.xlabel('Azimuth')
-        plt.ylabel('Altitude')
-        plt.subplot(235)
-        plt.imshow(np.abs(image), cmap='gray')
-        plt.axis('off')
-        plt.title('Dirty Image (BW = {:.1f} deg)'.format(np.amax(beamwidths)))
-        plt.xlabel('Azimuth')
-        plt.ylabel('Altitude')
-        plt.subplot(236)
-        plt.imshow(np.abs(cleaned), cmap='gray')
-        plt.axis('off')
-        plt.title('CLEANed ({:d} iters, lambda={:.2f})'.format(iters, lmbda))
-        plt.xlabel('Azimuth')
-        plt.ylabel('Altitude')
-        plt.tight_layout(pad=4.0)
-        plt.show()
+        show_results(results)
+
+    if args.cprofile:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
+    if args.profile:
+        write_profile(aflux.PROFILER.report(), args.profile)
+        aflux.PROFILER.disable()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,15 +1,19 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import functools
+import hashlib
+import os
+import time
 import numpy as np
-import matplotlib.pyplot as plt
-from astropy.io import fits
-from astropy.visualization.wcsaxes.frame import EllipticalFrame
-from astropy.coordinates import SkyCoord, AltAz, EarthLocation, ICRS
-from astropy import units as u
-from astropy.time import Time
-from astropy.wcs import WCS
-from scipy.signal import convolve2d
+
+# astropy and scipy are slow to import, so they are imported in the functions that need them
 
 class SkyMap(object):
     """ Abstract sky map class. """
+    # whether `get_temp_mk` depends on the sample coordinates
+    uses_coordinates = True
+
     def get_temp_mk(self, ra_dec_samples):
         """
         Parameters
@@ -25,17 +29,70 @@ class SkyMap(object):
 class FITSSkyMap(SkyMap):
     """
     A FITS sky map utility.
+
+    The image is memory-mapped, so it is paged in lazily and shared
+    read-only between processes that open the same file. Samples are 
+    looked up by rotating (ra, dec) into the map's celestial frame with 
+    a precomputed matrix, which assumes that frame is a fixed rotation 
+    of ICRS (e.g. ICRS, FK5 or Galactic).
     """
-    def __init__(self, fits_path):
+    def __init__(self, fits_path, interpolation='nearest'):
         """
         Parameters
         ----------
         fits_path : str
             path to FITS sky file
+
+        interpolation : str
+            "nearest" to take the pixel containing each sample 
+            or "bilinear" to interpolate between pixel centers
         """
-        f = fits.open(fits_path)[1]
+        if interpolation not in ('nearest', 'bilinear'):
+            raise ValueError('unknown interpolation "{}"'.format(interpolation))
+        from astropy.io import fits
+        from astropy.coordinates import SkyCoord, ICRS
+        from astropy.wcs import WCS
+        from astropy.wcs.utils import wcs_to_celestial_frame
+        self.fits_path = fits_path
+        self.interpolation = interpolation
+        f = fits.open(fits_path, memmap=True)[1]
         self.image_data = f.data
-        self.w = WCS(f.header)
+        self.image_data.setflags(write=False)
+        self.w = WCS(f.header).celestial
+        frame = wcs_to_celestial_frame(self.w)
+        # columns are the ICRS x, y, z unit vectors in the map frame
+        basis = SkyCoord(
+            x=[1, 0, 0], y=[0, 1, 0], z=[0, 0, 1], 
+            representation_type='cartesian', 
+            frame=ICRS()
+        ).transform_to(frame).cartesian
+        self.rotation = np.array([basis.x.value, basis.y.value, basis.z.value])
+
+    def __getstate__(self):
+        # pickle by path so worker processes map the file themselves
+        return {'fits_path': self.fits_path, 'interpolation': self.interpolation}
+
+    def __setstate__(self, state):
+        self.__init__(state['fits_path'], state['interpolation'])
+
+    def to_pixel(self, ra_dec_samples):
+        """
+        Parameters
+        ----------
+        ra_dec_samples : ndarray
+            Nx2 matrix of (ra, dec) coordinates in degrees
+
+        Returns
+        -------
+        coordspix : ndarray
+            Nx2 matrix of 0-based (x, y) pixel coordinates
+        """
+        ra, dec = np.radians(ra_dec_samples[:,0]), np.radians(ra_dec_samples[:,1])
+        xyz = np.stack((np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra), np.sin(dec)))
+        x, y, z = self.rotation.dot(xyz)
+        lon = np.degrees(np.arctan2(y, x)) % 360
+        lat = np.degrees(np.arcsin(np.clip(z, -1, 1)))
+        return np.array(self.w.all_world2pix(lon, lat, 0)).T
 
     def get_temp_mk(self, ra_dec_samples):
         """
@@ -49,14 +106,27 @@ class FITSSkyMap(SkyMap):
         pixel_temps : ndarray
             Nx1 matrix of pixel temperatures in mK
         """
-        targets = SkyCoord(ra_dec_samples[:,0]*u.degree, ra_dec_samples[:,1]*u.degree)
-        coordspix = np.array(targets.to_pixel(self.w)).T
-        idx = np.floor(coordspix).astype(int)
-        image = self.image_data[idx[:,1], idx[:,0]]
-        return image
+        coordspix = self.to_pixel(ra_dec_samples)
+        if self.interpolation == 'nearest':
+            idx = np.floor(coordspix).astype(int)
+            return self.image_data[idx[:,1], idx[:,0]]
+        ny, nx = self.image_data.shape
+        x0 = np.clip(np.floor(coordspix[:,0]).astype(int), 0, nx - 2)
+        y0 = np.clip(np.floor(coordspix[:,1]).astype(int), 0, ny - 2)
+        fx = np.clip(coordspix[:,0] - x0, 0, 1)
+        fy = np.clip(coordspix[:,1] - y0, 0, 1)
+        data = self.image_data
+        return (
+            data[y0, x0]*(1 - fx)*(1 - fy) + 
+            data[y0, x0 + 1]*fx*(1 - fy) + 
+            data[y0 + 1, x0]*(1 - fx)*fy + 
+            data[y0 + 1, x0 + 1]*fx*fy
+        )
 
 class CrossSky(SkyMap):
     """ A debug sky that always shows a cross. """
+    uses_coordinates = False
+
     def get_temp_mk(self, ra_dec_samples):
         N = int(np.sqrt(ra_dec_samples.shape[0]))
         image = np.zeros((N,N))
@@ -67,17 +137,23 @@ class CrossSky(SkyMap):
     
 class StarSky(SkyMap):
     """ A debug sky that always shows a star field. """
-    def __init__(self, N):
+    uses_coordinates = False
+
+    def __init__(self, N, rng=None):
         """
         Parameters
         ----------
         N : int
             image dimension
+
+        rng : numpy.random.Generator | None
+            random generator for the star positions
         """
+        rng = np.random.default_rng() if rng is None else rng
         image = np.zeros((N,N))
         image[:] = 0.0
         for _ in range(5):
-            pos = np.random.rand(2)*N
+            pos = rng.random(2)*N
             image[int(pos[0]), int(pos[1])] = 1
         self.image = image
 
@@ -128,6 +204,258 @@ class Observation(object):
             self.timestamp
         )
 
+class LRUCache(object):
+    """ A least-recently-used cache with hit/miss counters. """
+    def __init__(self, maxsize=128):
+        """
+        Parameters
+        ----------
+        maxsize : int
+            maximum number of entries to keep
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, compute):
+        """
+        Parameters
+        ----------
+        key : hashable
+            cache key
+
+        compute : callable
+            called with no arguments to produce the value on a miss
+
+        Returns
+        -------
+        value : object
+            the cached or newly computed value
+        """
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        self.misses += 1
+        value = compute()
+        self._entries[key] = value
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        """ Drop all entries and reset the counters. """
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        """
+        Returns
+        -------
+        info : dict
+            hits, misses, current size and maximum size
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+        }
+
+# ra/dec sky samples for each distinct pointing, shared by all `simulate` calls
+TRANSFORM_CACHE = LRUCache(maxsize=256)
+
+class StageProfiler(object):
+    """
+    Wall time and peak traced memory of named stages, e.g. the sky 
+    transforms or the imaging DFT. Stages nest and their times include 
+    the stages inside them. Disabled (the default), stages cost one 
+    attribute check. Only the current process is measured, so stages run
+    by worker processes are not included.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.reset()
+
+    def reset(self):
+        """ Drop the recorded stages and steps. """
+        self.stages = OrderedDict()
+        self.steps = OrderedDict()
+        self._step = None
+        self._open = []
+        self._start = time.perf_counter()
+
+    def enable(self, memory=True):
+        """
+        Parameters
+        ----------
+        memory : bool
+            also record the peak memory of each stage with `tracemalloc`
+            (which slows down Python allocations while tracing)
+        """
+        self.reset()
+        self.enabled = True
+        self.memory = memory
+        if memory:
+            import tracemalloc
+            tracemalloc.start()
+
+    def disable(self):
+        """ Stop recording; the recorded stages are kept for `report`. """
+        if self.memory:
+            import tracemalloc
+            tracemalloc.stop()
+        self.enabled = False
+        self.memory = False
+
+    def _sample_peak(self):
+        # fold the traced peak into the open stages, then start a new peak
+        import tracemalloc
+        _, peak = tracemalloc.get_traced_memory()
+        for record in self._open:
+            record['peak_bytes'] = max(record['peak_bytes'], peak)
+        # without reset_peak (Python < 3.9) the peaks are since `enable`
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    def stage(self, name):
+        """
+        Parameters
+        ----------
+        name : str
+            stage name
+
+        Returns
+        -------
+        timer : context manager
+            records the time spent inside it under `name`
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timed_stage(name)
+
+    @contextlib.contextmanager
+    def _timed_stage(self, name):
+        record = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'peak_bytes': 0})
+        step = self._step
+        if self.memory:
+            self._sample_peak()
+        self._open.append(record)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if self.memory:
+                self._sample_peak()
+            # by identity: records of stages that just opened compare equal
+            del self._open[max(i for i, r in enumerate(self._open) if r is record)]
+            record['seconds'] += seconds
+            record['calls'] += 1
+            if step is not None:
+                step_stages = self.steps[step]['stages']
+                step_stages[name] = step_stages.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def step(self, index):
+        """
+        Parameters
+        ----------
+        index : int
+            time step; the stages inside are also recorded for this step
+
+        Returns
+        -------
+        timer : context manager
+            records the time spent inside it for step `index`
+        """
+        if not self.enabled:
+            yield
+            return
+        self._step = index
+        record = self.steps.setdefault(index, {'seconds': 0.0, 'stages': OrderedDict()})
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record['seconds'] += time.perf_counter() - start
+            self._step = None
+
+    def timed(self, name):
+        """
+        Parameters
+        ----------
+        name : str
+            stage name
+
+        Returns
+        -------
+        decorator : callable
+            wraps a function so each call is recorded as stage `name`
+        """
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with self._timed_stage(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def report(self):
+        """
+        Returns
+        -------
+        report : dict
+            wall time since `enable`, and the seconds, calls and peak 
+            traced bytes of each stage, and the seconds of each step and 
+            its stages
+        """
+        return {
+            'total_s': time.perf_counter() - self._start,
+            'stages': {name: dict(record) for name, record in self.stages.items()},
+            'steps': [
+                {'step': index, 'seconds': record['seconds'], 'stages': dict(record['stages'])}
+                for index, record in self.steps.items()
+            ],
+        }
+
+# stage timings of the current process, off unless enabled (e.g. by `astroflux.py --profile`)
+PROFILER = StageProfiler()
+
+# speed of light in m/s
+SPEED_OF_LIGHT = 299792458.0
+
+def channel_wavelengths(wavelength, bandwidth, channels):
+    """
+    Parameters
+    ----------
+    wavelength : float
+        wavelength at the center of the band in meters
+
+    bandwidth : float
+        bandwidth in Hz
+
+    channels : int
+        number of channels C to split the band into
+
+    Returns
+    -------
+    wavelengths : ndarray
+        C vector of the wavelengths at the channel centers, 
+        from the lowest to the highest frequency
+    """
+    center = SPEED_OF_LIGHT / wavelength
+    offsets = (np.arange(channels) - (channels - 1) / 2) * bandwidth / channels
+    return SPEED_OF_LIGHT / (center + offsets)
+
 def parabolic_beamwidth(dishsize, wavelength, degrees=False):
     """
     Calculate the beamwidth of a parabolic dish.
@@ -179,6 +507,7 @@ def generate_alt_az_samples(beamwidth_deg, alt, az, samples_per_dim):
     alt_az_samples = np.stack((AL.reshape(-1), AZ.reshape(-1)), axis=1)
     return alt_az_samples
 
+@PROFILER.timed('transforms')
 def convert_alt_az_to_ra_dec(alt_az_samples, lat, lon, timestamp):
     """
     Parameters
@@ -191,6 +520,9 @@ def convert_alt_az_to_ra_dec(alt_az_samples, lat, lon, timestamp):
     ra_dec_samples : ndarray
         Nx2 matrix of (ra, dec) coordinates
     """
+    from astropy.coordinates import AltAz, EarthLocation, ICRS
+    from astropy import units as u
+    from astropy.time import Time
     location = EarthLocation(
         lat=lat*u.degree, 
         lon=lon*u.degree, 
@@ -205,6 +537,7 @@ def convert_alt_az_to_ra_dec(alt_az_samples, lat, lon, timestamp):
     coords = coords.transform_to(ICRS())
     return np.array([coords.ra.degree, coords.dec.degree]).T
 
+@PROFILER.timed('transforms')
 def convert_ra_dec_to_alt_az(ra_dec_samples, lat, lon, timestamp):
     """
     Parameters
@@ -226,32 +559,400 @@ def convert_ra_dec_to_alt_az(ra_dec_samples, lat, lon, timestamp):
     alt_az_samples : ndarray
         Nx2 matrix of (alt, az) coordinates in degrees
     """
+    from astropy.coordinates import SkyCoord, AltAz, EarthLocation
+    from astropy import units as u
+    from astropy.time import Time
     c = SkyCoord(ra=ra_dec_samples[:,0]*u.degree, dec=ra_dec_samples[:,1]*u.degree, frame='icrs')
     location = EarthLocation(lat=lat*u.degree, lon=lon*u.degree, height=0)
     aa = c.transform_to(AltAz(obstime=Time(timestamp), location=location))
     return np.array([aa.alt.degree, aa.az.degree]).T
 
-def create_antenna_beam_lm_samples(beamwidth_deg, samples_per_dim):
+def create_antenna_beam_lm_samples(beamwidth_deg, samples_per_dim, cache=None):
     """
     Parameters
     ----------
     beamwidth_deg : float
         beamwidth of the antenna in degrees
 
+    cache : LRUCache | None
+        cache of previous grids (e.g. `LM_GRID_CACHE`, see 
+        `beam_phase_kernel`), or None to always create a new grid
+
     Returns
     -------
     lm_grid_samples : ndarray
         samples_per_dim^2 x 2 matrix of (l,m) direction cosine 
-        pairs for the given beamwidth
+        pairs for the given beamwidth (read-only when cached)
     """
+    if cache is not None:
+        return beam_phase_kernel(beamwidth_deg, samples_per_dim, cache).lm
     l = np.arange(-0.5, 0.5, 1/samples_per_dim) * beamwidth_deg / 90
     m = l.copy()
     L,M = np.meshgrid(l,m)
     lm = np.stack((L.reshape(-1), M.reshape(-1)), axis=1)
     return lm
 
+class PhaseKernel(object):
+    """
+    Sums of exp(sign*i*2pi*(l*x + m*y)) over a fixed lm grid. On a
+    regular grid the exponential factors into exp(sign*i*2pi*l*x) times
+    exp(sign*i*2pi*m*y), so the sums (`contract` and `image`) take two
+    (axis length) x J exponentials and matrix products of them, instead
+    of a P x J phase matrix.
+    """
+    def __init__(self, lm):
+        """
+        Parameters
+        ----------
+        lm : ndarray
+            P x 2 matrix of (l,m) points
+        """
+        self.lm = lm
+        self.l_axis, self.l_index, self.m_axis, self.m_index = lm_grid_axes(lm)
+        Nl, Nm = self.l_axis.shape[0], self.m_axis.shape[0]
+        P = lm.shape[0]
+        self.separable = Nl + Nm < P
+        # grids from `create_antenna_beam_lm_samples` run along l within each m row
+        self.meshgrid = P == Nl*Nm and \
+            np.array_equal(self.l_index, np.tile(np.arange(Nl), Nm)) and \
+            np.array_equal(self.m_index, np.repeat(np.arange(Nm), Nl))
+
+    def factors(self, xy, sign=-1, dtype=complex):
+        """
+        Parameters
+        ----------
+        xy : ndarray
+            J x 2 matrix of positions in wavelengths
+
+        sign : int
+            sign of the exponent
+
+        dtype : numpy dtype
+            complex dtype of the factors
+
+        Returns
+        -------
+        exp_l : ndarray
+            (l axis length) x J exponentials of the l terms
+
+        exp_m : ndarray
+            (m axis length) x J exponentials of the m terms
+        """
+        real = real_dtype(dtype)
+        xy = np.asarray(xy, dtype=real)
+        exp_l = expi(sign*2*np.pi*np.outer(self.l_axis.astype(real), xy[:,0]))
+        exp_m = expi(sign*2*np.pi*np.outer(self.m_axis.astype(real), xy[:,1]))
+        return exp_l, exp_m
+
+    def contract(self, pixelvalues, xy, sign=-1, dtype=complex):
+        """
+        Sum of the pixels times the phase matrix, without forming it:
+        the pixels are laid out as an (m axis) x (l axis) grid, multiplied
+        by the l factors and reduced against the m factors.
+
+        Parameters
+        ----------
+        pixelvalues : ndarray
+            P vector of real pixel values, or K x P for K sets of J
+            positions
+
+        xy : ndarray
+            J x 2 (or K*J x 2) matrix of positions in wavelengths
+
+        sign : int
+            sign of the exponent
+
+        dtype : numpy dtype
+            complex dtype of the factors and the result
+
+        Returns
+        -------
+        values : ndarray
+            J vector sum_p pixelvalues[p]*exp(sign*i*2pi*lm_p.xy_j),
+            or K x J
+        """
+        real = real_dtype(dtype)
+        if not self.separable:
+            phases = expi(sign*2*np.pi*self.lm.astype(real).dot(np.asarray(xy, dtype=real).T))
+            if np.ndim(pixelvalues) == 1:
+                return np.asarray(pixelvalues, dtype=real).dot(phases)
+            K = pixelvalues.shape[0]
+            return np.einsum('kp,pkj->kj', np.asarray(pixelvalues, dtype=real), phases.reshape(phases.shape[0], K, -1))
+        grid = self._to_grid(np.asarray(pixelvalues, dtype=real))
+        exp_l, exp_m = self.factors(xy, sign, dtype)
+        if grid.ndim == 3:
+            # one (m axis) x J product per pixel vector
+            K = grid.shape[0]
+            exp_l = exp_l.reshape(exp_l.shape[0], K, -1).transpose(1, 0, 2)
+            exp_m = exp_m.reshape(exp_m.shape[0], K, -1).transpose(1, 0, 2)
+        # the pixels are real, so multiply by the real and imaginary parts
+        partial = np.matmul(grid, exp_l.real) + 1j*np.matmul(grid, exp_l.imag)
+        partial *= exp_m
+        return partial.sum(axis=-2).astype(dtype, copy=False)
+
+    def image(self, xcorr, uv, dtype=complex, max_mem=None):
+        """
+        Visibilities transformed to the lm points, sum_v xcorr[v]*
+        exp(i*2pi*uv_v.lm_p), as an (m axis) x (l axis) matrix product of
+        the visibility weighted m factors and the l factors.
+
+        Parameters
+        ----------
+        xcorr : ndarray
+            V vector of visibilities
+
+        uv : ndarray
+            V x 2 matrix of baselines in wavelengths
+
+        dtype : numpy dtype
+            complex dtype of the factors and the result
+
+        max_mem : int | None
+            memory budget in bytes for the factors of a block of
+            visibilities, or None to take them all at once
+
+        Returns
+        -------
+        pixelvalues : ndarray
+            P vector of pixel values
+        """
+        xcorr = np.asarray(xcorr, dtype=dtype).reshape(-1)
+        Nl, Nm = self.l_axis.shape[0], self.m_axis.shape[0]
+        V = xcorr.shape[0]
+        block = V
+        if max_mem is not None:
+            block = int(max(1, min(V, max_mem // (2*np.dtype(dtype).itemsize*(Nl + Nm)))))
+        image = np.zeros((Nm, Nl), dtype=dtype)
+        for start in range(0, V, block):
+            exp_l, exp_m = self.factors(uv[start:start+block], 1, dtype)
+            exp_m *= xcorr[start:start+block]
+            image += exp_m.dot(exp_l.T)
+        if self.meshgrid:
+            return image.reshape(-1)
+        return image[self.m_index, self.l_index]
+
+    def _to_grid(self, pixelvalues):
+        Nl, Nm = self.l_axis.shape[0], self.m_axis.shape[0]
+        shape = pixelvalues.shape[:-1] + (Nm, Nl)
+        if self.meshgrid:
+            return pixelvalues.reshape(shape)
+        grid = np.zeros((int(np.prod(pixelvalues.shape[:-1])), Nm*Nl), dtype=pixelvalues.dtype)
+        # points that repeat add up, as they do in the phase matrix product
+        np.add.at(grid, (slice(None), self.m_index*Nl + self.l_index), pixelvalues.reshape(grid.shape[0], -1))
+        return grid.reshape(shape)
+
+# phase kernels (and their lm grids) for each (beamwidth, samples_per_dim)
+LM_GRID_CACHE = LRUCache(maxsize=32)
+
+def beam_phase_kernel(beamwidth_deg, samples_per_dim, cache=LM_GRID_CACHE):
+    """
+    Parameters
+    ----------
+    beamwidth_deg : float
+        beamwidth of the antenna in degrees
+
+    samples_per_dim : int
+        samples per dimension of the lm grid
+
+    cache : LRUCache | None
+        cache of previous kernels, or None to always create a new one
+
+    Returns
+    -------
+    kernel : PhaseKernel
+        phase kernel of the read-only grid from 
+        `create_antenna_beam_lm_samples`
+    """
+    def create():
+        lm = create_antenna_beam_lm_samples(beamwidth_deg, samples_per_dim)
+        lm.setflags(write=False)
+        return PhaseKernel(lm)
+    if cache is None:
+        return create()
+    return cache.get((float(beamwidth_deg), int(samples_per_dim)), create)
+
+
+def normalize_pixels(pixelvalues):
+    """
+    Parameters
+    ----------
+    pixelvalues : ndarray
+        N^2 x 1 matrix of pixel values
+
+    Returns
+    -------
+    px : ndarray
+        pixel values scaled to [0, 1]
+    """
+    return (pixelvalues - np.amin(pixelvalues)) / (np.amax(pixelvalues) - np.amin(pixelvalues))
+
+def real_dtype(dtype):
+    """
+    Parameters
+    ----------
+    dtype : numpy dtype
+        complex (or real) dtype, e.g. `np.complex64`
+
+    Returns
+    -------
+    dtype : numpy dtype
+        the real dtype of the same precision, e.g. `np.float32`
+    """
+    return np.finfo(dtype).dtype
+
+def expi(phases):
+    """
+    Parameters
+    ----------
+    phases : ndarray
+        real array of phases in radians
+
+    Returns
+    -------
+    factors : ndarray
+        exp(1j*phases) with the precision of `phases`, evaluated as 
+        cos + i sin (much faster than the complex exp in single precision)
+    """
+    factors = np.empty(phases.shape, dtype=np.result_type(phases.dtype, np.complex64))
+    np.cos(phases, out=factors.real)
+    np.sin(phases, out=factors.imag)
+    return factors
+
+# `quantize_with_noise` draws every sample up to this many samples per pixel
+NOISE_DRAW_SAMPLES = 8
+
+# memory budget in bytes for each block of drawn noise samples
+NOISE_MAX_MEM = 2**26
+
+def noise_scale(snr):
+    """
+    Parameters
+    ----------
+    snr : float
+        signal-to-noise-ratio in dB
+
+    Returns
+    -------
+    noisemag : float
+        standard deviation of the noise added to normalized pixels
+
+    dynamic_range : float
+        quantization step
+    """
+    noisepower = 10**(-snr/20)
+    noisemag = np.sqrt(noisepower)
+    return noisemag, 4*noisemag
+
+def quantization_levels(px, snr):
+    """
+    Parameters
+    ----------
+    px : ndarray
+        N^2 vector of normalized pixel values
+
+    snr : float
+        signal-to-noise-ratio in dB
+
+    Returns
+    -------
+    levels : ndarray
+        K x N^2 matrix of the quantized values each pixel can take
+        (before the absolute value)
+
+    probabilities : ndarray
+        K x N^2 matrix of the probability of each level; the first and
+        last levels also hold the (negligible) tails
+    """
+    from scipy.special import erf
+    noisemag, dynamic_range = noise_scale(snr)
+    mean, std = px / dynamic_range, noisemag / dynamic_range
+    # levels more than 10 standard deviations from the mean never occur
+    span = int(np.ceil(10*std)) + 1
+    levels = np.round(mean) + np.arange(-span, span + 1)[:,np.newaxis]
+    cdf = lambda x: 0.5*(1 + erf(x / (std*np.sqrt(2))))
+    upper = cdf(levels + 0.5 - mean)
+    upper[-1] = 1.0
+    lower = np.vstack((np.zeros((1, px.shape[0])), upper[:-1]))
+    return levels, np.clip(upper - lower, 0, 1)
+
+def draw_quantized_average(levels, probabilities, samples, rng):
+    """
+    Draw how often each quantization level occurs in `samples` noisy
+    samples, one binomial per level conditioned on the levels before it,
+    so the cost does not depend on the number of samples.
+
+    Parameters
+    ----------
+    levels, probabilities : ndarray
+        see `quantization_levels`
+
+    samples : int
+        number of noisy quantized samples to average
+
+    rng : numpy.random.Generator
+        random generator
+
+    Returns
+    -------
+    px : ndarray
+        N^2 vector of averaged noisy quantized pixel values
+    """
+    remaining = np.full(levels.shape[1], samples, dtype=np.int64)
+    rest = np.ones(levels.shape[1])
+    total = np.zeros(levels.shape[1])
+    for k in range(levels.shape[0] - 1):
+        p = np.clip(probabilities[k] / np.maximum(rest, 1e-300), 0, 1)
+        counts = rng.binomial(remaining, p)
+        total += np.abs(levels[k])*counts
+        remaining -= counts
+        rest -= probabilities[k]
+    total += np.abs(levels[-1])*remaining
+    return total / samples
+
+def quantize_with_noise(px, snr, samples=1, rng=None, max_mem=NOISE_MAX_MEM):
+    """
+    Parameters
+    ----------
+    px : ndarray
+        N^2 vector of normalized pixel values
 
-def generate_antenna_signals(antenna_xy, antenna_beam_lm_samples, pixelvalues, wavelength, snr=None, samples=1):
+    snr : float
+        signal-to-noise-ratio in dB
+
+    samples : int
+        number of noisy quantized samples to average; above 
+        `NOISE_DRAW_SAMPLES` the average is drawn from its exact 
+        distribution (see `draw_quantized_average`) instead of 
+        drawing every sample
+
+    rng : numpy.random.Generator | None
+        random generator (default a new unseeded one)
+
+    max_mem : int
+        memory budget in bytes for each block of drawn samples
+
+    Returns
+    -------
+    px : ndarray
+        N^2 vector of averaged noisy quantized pixel values
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    if samples > NOISE_DRAW_SAMPLES:
+        levels, probabilities = quantization_levels(px, snr)
+        return draw_quantized_average(levels, probabilities, samples, rng)
+    noisemag, dynamic_range = noise_scale(snr)
+    withnoise = np.zeros(px.shape)
+    block = int(max(1, min(samples, max_mem // (8*px.shape[0]))))
+    for start in range(0, samples, block):
+        noise = rng.standard_normal((min(block, samples - start), px.shape[0]))
+        noise *= noisemag
+        noise += px
+        noise /= dynamic_range
+        withnoise += np.sum(np.abs(np.round(noise)), axis=0)
+    return withnoise / samples
+
+@PROFILER.timed('phase_matrix')
+def generate_antenna_signals(antenna_xy, antenna_beam_lm_samples, pixelvalues, wavelength, snr=None, samples=1, dtype=complex, rng=None, kernel=None):
     """ 
     Parameters
     ----------
@@ -265,8 +966,9 @@ def generate_antenna_signals(antenna_xy, antenna_beam_lm_samples, pixelvalues, w
     pixelvalues : ndarray
         N^2 x 1 matrix of pixel values corresponding to the sampled lm plane
 
-    wavelength : float
-        wavelength in meters
+    wavelength : float | ndarray
+        wavelength in meters, or C vector of channel wavelengths 
+        (see `channel_wavelengths`)
 
     snr : float | None
         signal-to-noise-ratio of the sky data or None if no noise
@@ -274,42 +976,157 @@ def generate_antenna_signals(antenna_xy, antenna_beam_lm_samples, pixelvalues, w
     samples : int
         number of samples to average for this short term interval
 
+    dtype : numpy dtype
+        complex dtype of the phase matrix and the output 
+        (`np.complex64` halves the memory of double precision)
+
+    rng : numpy.random.Generator | None
+        random generator for the noise
+
+    kernel : PhaseKernel | None
+        phase kernel of `antenna_beam_lm_samples` to sum the pixel
+        phases with (see `beam_phase_kernel`)
+
     Returns
     -------
     antenna_signals : ndarray
-        Jx1 vector of antenna output (assume heterodyned)
+        Jx1 vector of antenna output (assume heterodyned),
+        or C x J x 1 for each channel
     """
-    # normalize the pixel values
-    px = (pixelvalues - np.amin(pixelvalues)) / (np.amax(pixelvalues) - np.amin(pixelvalues))
+    real = real_dtype(dtype)
+    px = normalize_pixels(pixelvalues)
+    if np.ndim(wavelength) == 1:
+        # one phase matrix for all channels, from the positions in wavelengths
+        C, J = len(wavelength), antenna_xy.shape[0]
+        rng = np.random.default_rng() if rng is None else rng
+        xy = (antenna_xy[np.newaxis] / np.reshape(wavelength, (-1, 1, 1))).reshape(-1, 2)
+        if snr:
+            px = np.stack([quantize_with_noise(px, snr, samples, rng) for _ in wavelength])
+        if kernel is not None:
+            return kernel.contract(px, xy, -1, dtype).reshape(C, J, 1)
+        if not snr:
+            px = np.broadcast_to(px, (C, px.shape[0]))
+        phase_delays = expi(-2*np.pi*antenna_beam_lm_samples.astype(real).dot(xy.T.astype(real)))
+        phase_delays = phase_delays.reshape(-1, C, J)
+        return np.einsum('pcj,cp->cj', phase_delays, px.astype(real))[:,:,np.newaxis]
     if snr:
-        noisepower = 10**(-snr/20)
-        noisemag = np.sqrt(noisepower)
-        dynamic_range = 4*noisemag
-        offset = dynamic_range*0.5
-        withnoise = np.zeros(px.shape)
-        for i in range(samples):
-            noise = np.random.randn(px.shape[0])*noisemag
-            withnoise += np.abs(np.round((px + noise) / dynamic_range))
-        px = withnoise / samples
-
-    phase_delays = 2*np.pi*antenna_beam_lm_samples.dot(antenna_xy.T/wavelength)
-    phase_delays = np.exp(-1j * phase_delays)
-    rx = phase_delays.T.dot(px)
+        px = quantize_with_noise(px, snr, samples, rng)
+    px = px.astype(real)
+
+    if kernel is not None:
+        rx = kernel.contract(px.reshape(-1), antenna_xy / wavelength, -1, dtype)
+    else:
+        phase_delays = 2*np.pi*antenna_beam_lm_samples.astype(real).dot((antenna_xy.T/wavelength).astype(real))
+        phase_delays = expi(-phase_delays)
+        rx = phase_delays.T.dot(px)
     rx = rx.reshape(rx.shape[0],1)
     return rx
     
-def xcorr_signals(signals):
+def baseline_pairs(num_antennas):
+    """
+    Parameters
+    ----------
+    num_antennas : int
+        number of antennas J
+
+    Returns
+    -------
+    pairs : ndarray
+        B x 2 matrix of antenna indices (i, j), i < j, of the 
+        B = J(J-1)/2 unique baselines
+    """
+    return np.stack(np.triu_indices(num_antennas, 1), axis=1)
+
+def autocorrelation_sum(signals):
+    """
+    Parameters
+    ----------
+    signals : ndarray
+        J x M (or T x J x M) array of antenna signals
+
+    Returns
+    -------
+    zero_spacing : float
+        sum of all antenna autocorrelations, the zero-length baselines
+        left out by the unique baseline representation
+    """
+    return float(np.sum(np.abs(signals)**2))
+
+def average_redundant_baselines(uv, xcorr, tolerance, weights=None, hermitian=False):
+    """
+    Merge baselines whose (u,v) fall in the same cell of a grid with 
+    `tolerance` spacing into one weighted visibility at their mean (u,v).
+
+    Parameters
+    ----------
+    uv : ndarray
+        V x 2 matrix of (u,v) baselines in wavelengths
+
+    xcorr : ndarray
+        V vector of cross correlations
+
+    tolerance : float
+        cell size of the merging grid in wavelengths
+
+    weights : ndarray | None
+        V vector of visibility weights (default all ones)
+
+    hermitian : bool
+        the visibilities are unique baselines (see `compute_dirty_image`),
+        so baselines that are redundant with another's conjugate are 
+        merged too
+
+    Returns
+    -------
+    uv : ndarray
+        U x 2 matrix of merged baselines
+
+    xcorr : ndarray
+        U vector of weighted mean cross correlations
+
+    weights : ndarray
+        U vector of summed weights; imaging with them (see 
+        `compute_dirty_image`) matches imaging the original baselines,
+        at a cost that scales with U instead of V
+    """
+    xcorr = np.asarray(xcorr).reshape(-1)
+    weights = np.ones(xcorr.shape[0]) if weights is None else np.asarray(weights, dtype=float)
+    if hermitian:
+        # move every baseline to the u > 0 half plane
+        flip = (uv[:,0] < 0) | ((uv[:,0] == 0) & (uv[:,1] < 0))
+        uv = np.where(flip[:,np.newaxis], -uv, uv)
+        xcorr = np.where(flip, xcorr.conj(), xcorr)
+    cells = np.round(uv / tolerance).astype(np.int64)
+    _, inverse = np.unique(cells, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    total = np.bincount(inverse, weights)
+    merged_uv = np.stack((
+        np.bincount(inverse, weights*uv[:,0]), 
+        np.bincount(inverse, weights*uv[:,1])
+    ), axis=1) / total[:,np.newaxis]
+    weighted = weights*xcorr
+    merged_xcorr = (np.bincount(inverse, weighted.real) + 1j*np.bincount(inverse, weighted.imag)) / total
+    return merged_uv, merged_xcorr, total
+
+def xcorr_signals(signals, unique=False):
     """
     Parameters
     ----------
     signals : ndarray
         JxM vector of stacked input signals
 
+    unique : bool
+        only correlate the unique baselines (see `baseline_pairs`)
+
     Returns
     -------
     xcorr_matrix : ndarray
-        JxJ matrix of cross correlation results
+        JxJ matrix of cross correlation results,
+        or B vector for the unique baselines
     """
+    if unique:
+        i, j = baseline_pairs(signals.shape[0]).T
+        return np.sum(signals[i]*signals[j].conj(), axis=1)
     xcorr = signals.dot(signals.conj().T)
     return xcorr
 
@@ -333,21 +1150,33 @@ def propagate_antennas(antenna_xy, elapsed):
     rotmat = np.array(((c, -s),(s, c)))
     return antenna_xy.dot(rotmat)
 
-def to_uv(antenna_xy, wavelength):
+def to_uv(antenna_xy, wavelength, unique=False):
     """
     Parameters
     ----------
     antenna_xy : ndarray
         Jx2 matrix of antenna (x,y) positions
 
-    wavelength : float
-        observation wavelength in meters
+    wavelength : float | ndarray
+        observation wavelength in meters, or C vector of channel 
+        wavelengths (see `channel_wavelengths`)
+
+    unique : bool
+        only return the unique baselines (see `baseline_pairs`); the 
+        others are their negatives or zero-length autocorrelations
 
     Returns
     -------
     uv_baselines : ndarray
-        J^2 x 2 matrix of baseline vectors
+        J^2 x 2 matrix of baseline vectors, or B x 2 for the unique baselines
+        (C x J^2 x 2 or C x B x 2 for each channel)
     """
+    if np.ndim(wavelength) == 1:
+        baselines = to_uv(antenna_xy, 1.0, unique)
+        return baselines[np.newaxis] / np.asarray(wavelength)[:,np.newaxis,np.newaxis]
+    if unique:
+        i, j = baseline_pairs(antenna_xy.shape[0]).T
+        return (antenna_xy[i] - antenna_xy[j]) / wavelength
     X = np.repeat(
         antenna_xy[:,0].reshape(antenna_xy.shape[0],1), 
         antenna_xy.shape[0], 
@@ -363,87 +1192,1458 @@ def to_uv(antenna_xy, wavelength):
     uv = np.stack((u,v), axis=1)
     return uv
 
-def simulate(observation, axy, beamwidth, wavelength, skymap, samples_per_dim=64, snr=None, samples=1):
+def sample_sky_ra_dec(observation, beamwidth, samples_per_dim, cache=TRANSFORM_CACHE):
     """
     Parameters
     ----------
     observation : Observation
         `Observation` object
 
-    axy : ndarray
-        Jx2 array of antenna (x,y) positions
-
     beamwidth : float
         antenna beamwidth in degrees
 
-    wavelength : float
-        wavelength in meters
-
-    skymap : SkyMap
-        `SkyMap` object
-
     samples_per_dim : int
         samples per dim of alt/az grid
 
-    snr : float | None
-        signal to noise ratio in dB
+    cache : LRUCache | None
+        cache of previous transforms or None to always recompute
+
+    Returns
+    -------
+    ra_dec_samples : ndarray
+        samples_per_dim^2 x 2 read-only matrix of (ra, dec) coordinates
+        covering the antenna beam around the target
+    """
+    def transform():
+        target_alt_az = observation.alt_az().squeeze()
+        alt_az_samples = generate_alt_az_samples(
+            beamwidth, 
+            target_alt_az[0], 
+            target_alt_az[1],
+            samples_per_dim
+        )
+        ra_dec_samples = convert_alt_az_to_ra_dec(
+            alt_az_samples, 
+            observation.lat, 
+            observation.lon, 
+            observation.timestamp
+        )
+        ra_dec_samples.setflags(write=False)
+        return ra_dec_samples
+
+    if cache is None:
+        return transform()
+    key = (
+        observation.ra, 
+        observation.dec, 
+        observation.lat, 
+        observation.lon, 
+        observation.timestamp, 
+        float(beamwidth), 
+        samples_per_dim
+    )
+    return cache.get(key, transform)
+
+def sample_sky(observation, skymap, beamwidth, samples_per_dim, cache=TRANSFORM_CACHE):
+    """
+    Parameters
+    ----------
+    observation : Observation
+        `Observation` object
+
+    skymap : SkyMap
+        `SkyMap` object
+
+    beamwidth : float
+        antenna beamwidth in degrees
+
+    samples_per_dim : int
+        samples per dim of alt/az grid
+
+    cache : LRUCache | None
+        cache of previous transforms (see `sample_sky_ra_dec`)
+
+    Returns
+    -------
+    pixeldata : ndarray
+        samples_per_dim^2 length vector of pixel values
+    """
+    if skymap.uses_coordinates:
+        ra_dec_samples = sample_sky_ra_dec(observation, beamwidth, samples_per_dim, cache)
+    else:
+        # the sky ignores where it is sampled, so skip the transforms
+        ra_dec_samples = np.zeros((samples_per_dim**2, 2))
+    with PROFILER.stage('sky_lookup'):
+        return skymap.get_temp_mk(ra_dec_samples)
+
+@PROFILER.timed('simulate')
+def simulate(observation, axy, beamwidth, wavelength, skymap, samples_per_dim=64, snr=None, samples=1, transform_cache=TRANSFORM_CACHE, rng=None):
+    """
+    Parameters
+    ----------
+    observation : Observation
+        `Observation` object
+
+    axy : ndarray
+        Jx2 array of antenna (x,y) positions
+
+    beamwidth : float
+        antenna beamwidth in degrees
+
+    wavelength : float
+        wavelength in meters
+
+    skymap : SkyMap
+        `SkyMap` object
+
+    samples_per_dim : int
+        samples per dim of alt/az grid
+
+    snr : float | None
+        signal to noise ratio in dB
+
+    samples : int
+        samples to use in each short-term interval
+
+    transform_cache : LRUCache | None
+        cache for the sky coordinate transforms (see `sample_sky_ra_dec`)
+
+    rng : numpy.random.Generator | None
+        random generator for the noise
+
+    Returns
+    -------
+    signals : ndarray   
+        a JxM matrix of noiseless stacked antenna signals from the skymap
+
+    pixeldata : ndarray
+        samples_per_dim^2 length vector of pixel values
+    """
+    pixeldata = sample_sky(observation, skymap, beamwidth, samples_per_dim, transform_cache)
+    kernel = beam_phase_kernel(beamwidth, samples_per_dim)
+    rx = generate_antenna_signals(axy, kernel.lm, pixeldata, wavelength, snr, samples, rng=rng, kernel=kernel)
+    return rx, pixeldata
+
+# default memory budget for the batched phase matrix in `generate_track_signals`
+TRACK_MAX_MEM = 2**28
+
+def propagate_track(antenna_xy, elapsed, out=None):
+    """
+    Parameters
+    ----------
+    antenna_xy : ndarray
+        Jx2 matrix of antenna (x,y) positions
+
+    elapsed : ndarray
+        T vector of elapsed hours
+
+    out : ndarray | None
+        preallocated T x J x 2 output
+
+    Returns
+    -------
+    track_xy : ndarray
+        T x J x 2 array of propagated positions (see `propagate_antennas`)
+    """
+    angle = np.asarray(elapsed, dtype=float) / 24 * 2*np.pi
+    s, c = np.sin(angle), np.cos(angle)
+    rotmats = np.stack((np.stack((c, -s), axis=1), np.stack((s, c), axis=1)), axis=1)
+    return np.matmul(antenna_xy[np.newaxis], rotmats, out=out)
+
+def to_uv_track(track_xy, wavelength, out=None, unique=False):
+    """
+    Parameters
+    ----------
+    track_xy : ndarray
+        T x J x 2 array of antenna (x,y) positions
+
+    wavelength : float
+        observation wavelength in meters
+
+    out : ndarray | None
+        preallocated T x J^2 x 2 (or T x B x 2) output
+
+    unique : bool
+        only return the unique baselines (see `baseline_pairs`)
+
+    Returns
+    -------
+    uv_baselines : ndarray
+        T x J^2 x 2 (or T x B x 2) array of baseline vectors (see `to_uv`)
+    """
+    T, J = track_xy.shape[:2]
+    if unique:
+        i, j = baseline_pairs(J).T
+        out = np.subtract(track_xy[:,i], track_xy[:,j], out=out)
+        out /= wavelength
+        return out
+    if out is None:
+        out = np.empty((T, J*J, 2))
+    uv = out.reshape(T, J, J, 2)
+    np.subtract(track_xy[:,:,np.newaxis,:], track_xy[:,np.newaxis,:,:], out=uv)
+    uv /= wavelength
+    return out
+
+@PROFILER.timed('phase_matrix')
+def generate_track_signals(track_xy, antenna_beam_lm_samples, pixelvalues, wavelength, snr=None, samples=1, out=None, max_mem=TRACK_MAX_MEM, dtype=complex, rngs=None, kernel=None):
+    """
+    Parameters
+    ----------
+    track_xy : ndarray
+        T x J x 2 array of antenna (x,y) positions
+
+    antenna_beam_lm_samples : ndarray
+        N^2 x 2 matrix of sampled direction cosine 
+        lm grid points for individual dish beam
+
+    pixelvalues : ndarray
+        N^2 x 1 matrix of pixel values corresponding to the sampled lm plane
+
+    wavelength : float | ndarray
+        wavelength in meters, or C vector of channel wavelengths
+
+    snr : float | None
+        signal-to-noise-ratio of the sky data or None if no noise
+
+    samples : int
+        number of samples to average for each time step (and channel)
+
+    out : ndarray | None
+        preallocated T x J x 1 (or T x C x J x 1) complex output
+
+    max_mem : int
+        memory budget in bytes for each batch of the phase matrix
+
+    dtype : numpy dtype
+        complex dtype of the phase matrix and the output
+
+    rngs : list | None
+        T random generators, one for the noise of each time step 
+        (drawing the channels in order), default one new unseeded 
+        generator for all of them
+
+    kernel : PhaseKernel | None
+        phase kernel of `antenna_beam_lm_samples` to sum the pixel
+        phases with (see `beam_phase_kernel`)
+
+    Returns
+    -------
+    antenna_signals : ndarray
+        T x J x 1 array of antenna outputs (see `generate_antenna_signals`),
+        or T x C x J x 1 for each channel
+    """
+    T, J = track_xy.shape[:2]
+    P = antenna_beam_lm_samples.shape[0]
+    real = real_dtype(dtype)
+    channels = np.shape(wavelength)
+    C = int(np.prod(channels))
+    if out is None:
+        out = np.empty((T,) + channels + (J, 1), dtype=dtype)
+    px = normalize_pixels(pixelvalues).reshape(-1)
+    lm = antenna_beam_lm_samples.astype(real)
+    if snr:
+        rngs = [np.random.default_rng()]*T if rngs is None else rngs
+        # the level probabilities only depend on the pixels
+        levels = probabilities = None
+        if samples > NOISE_DRAW_SAMPLES:
+            levels, probabilities = quantization_levels(px, snr)
+    # positions in wavelengths, T x C x J x 2 for all channels at once
+    wavelengths = np.asarray(wavelength, dtype=float).reshape(channels + (1, 1))
+    # phases and their exponentials, both P x (steps*C*J), or
+    # the per-axis factors and partial sums of a separable kernel
+    separable = kernel is not None and kernel.separable
+    width = kernel.l_axis.shape[0] + kernel.m_axis.shape[0] if separable else P
+    itemsize = np.dtype(dtype).itemsize
+    steps = int(max(1, min(T, max_mem // (3*itemsize//2*width*C*J))))
+    for start in range(0, T, steps):
+        block = (track_xy[start:start+steps, np.newaxis] if channels else track_xy[start:start+steps]) / wavelengths
+        Tb = block.shape[0]
+        if not separable:
+            phase_delays = lm.dot(block.reshape(-1, 2).T.astype(real))
+            phase_delays *= -2*np.pi
+            phase_delays = expi(phase_delays).reshape(P, Tb*C, J)
+        if snr:
+            noisy = np.stack([
+                draw_quantized_average(levels, probabilities, samples, rng) if levels is not None else
+                quantize_with_noise(px, snr, samples, rng) 
+                for rng in rngs[start:start+Tb] for _ in range(C)
+            ]).astype(real)
+            if separable:
+                rx = kernel.contract(noisy, block.reshape(-1, 2), -1, dtype)
+            else:
+                rx = np.einsum('tp,ptj->tj', noisy, phase_delays)
+        elif separable:
+            rx = kernel.contract(px, block.reshape(-1, 2), -1, dtype)
+        else:
+            rx = px.astype(real).dot(phase_delays.reshape(P, -1))
+        out[start:start+Tb, ..., 0] = rx.reshape((Tb,) + channels + (J,))
+    return out
+
+def xcorr_track(signals, out=None, unique=False):
+    """
+    Parameters
+    ----------
+    signals : ndarray
+        T x J x M array of stacked input signals
+
+    out : ndarray | None
+        preallocated T x J x J (or T x B) complex output
+
+    unique : bool
+        only correlate the unique baselines (see `baseline_pairs`)
+
+    Returns
+    -------
+    xcorr_matrices : ndarray
+        T x J x J array of cross correlations (see `xcorr_signals`),
+        or T x B for the unique baselines
+    """
+    if unique:
+        i, j = baseline_pairs(signals.shape[1]).T
+        return np.einsum('tbm,tbm->tb', signals[:,i], signals[:,j].conj(), out=out)
+    return np.matmul(signals, signals.conj().transpose(0, 2, 1), out=out)
+
+def beamwidth_groups(beamwidths):
+    """
+    Parameters
+    ----------
+    beamwidths : ndarray
+        J vector of antenna beamwidths
+
+    Returns
+    -------
+    groups : list
+        (antenna indices, beamwidth) pairs, one per distinct beamwidth,
+        ordered so the group holding the last antenna comes last
+    """
+    widths, inverse = np.unique(beamwidths, return_inverse=True)
+    groups = [(np.flatnonzero(inverse == g), bw) for g, bw in enumerate(widths)]
+    return sorted(groups, key=lambda group: group[0][-1])
+
+def noise_seeds(seed, steps):
+    """
+    Parameters
+    ----------
+    seed : int | None
+        seed for the whole observation, or None for a random one
+
+    steps : int
+        number of time steps T
+
+    Returns
+    -------
+    seeds : list
+        T independent `numpy.random.SeedSequence`, one per time step
+    """
+    return np.random.SeedSequence(seed).spawn(steps)
+
+def noise_generators(seeds, antenna):
+    """
+    Parameters
+    ----------
+    seeds : list
+        `numpy.random.SeedSequence` of each time step (see `noise_seeds`)
+
+    antenna : int
+        index of the (first) antenna the noise is for
+
+    Returns
+    -------
+    rngs : list
+        one independent generator per time step for this antenna, 
+        the same however the steps and antennas are split between workers
+    """
+    return [
+        np.random.default_rng(np.random.SeedSequence(s.entropy, spawn_key=s.spawn_key + (int(antenna),)))
+        for s in seeds
+    ]
+
+def simulate_track_signals(observation, antenna_xy, beamwidth, wavelength, skymap, elapsed, samples_per_dim=64, snr=None, samples=1, transform_cache=TRANSFORM_CACHE, max_mem=TRACK_MAX_MEM, group_beams=False, dtype=complex, seeds=None, first_antenna=0):
+    """
+    Parameters
+    ----------
+    observation : Observation
+        `Observation` object
+
+    antenna_xy : ndarray
+        Jx2 array of antenna (x,y) positions at the start of the track
+
+    beamwidth : float | ndarray
+        antenna beamwidth in degrees shared by all antennas,
+        or J vector of beamwidths to simulate each antenna separately
+
+    wavelength : float | ndarray
+        wavelength in meters, or C vector of channel wavelengths 
+        (see `channel_wavelengths`)
+
+    skymap : SkyMap
+        `SkyMap` object
+
+    elapsed : ndarray
+        T vector of elapsed hours for each time step
+
+    samples_per_dim : int
+        samples per dim of alt/az grid
+
+    snr : float | None
+        signal to noise ratio in dB
+
+    samples : int
+        samples to use in each short-term interval
+
+    transform_cache : LRUCache | None
+        cache for the sky coordinate transforms (see `sample_sky_ra_dec`)
+
+    max_mem : int
+        memory budget in bytes for each batch of the phase matrix
+
+    group_beams : bool
+        simulate antennas with identical beamwidths together, sharing
+        one sky sample (and one noise realization) per group
+
+    dtype : numpy dtype
+        complex dtype of the signals (see `generate_antenna_signals`)
+
+    seeds : list | None
+        T `numpy.random.SeedSequence` for the noise of each time step
+        (see `noise_generators`), or None for unseeded noise
+
+    first_antenna : int
+        index of the first antenna in the whole array, so the noise of
+        each antenna does not depend on how the array is split
+
+    Returns
+    -------
+    signals : ndarray
+        T x J x 1 (or T x C x J x 1) array of antenna signals for each step
+
+    pixeldata : ndarray
+        samples_per_dim^2 length vector of pixel values 
+        (for the last antenna when beamwidths differ)
+    """
+    T, J = len(elapsed), antenna_xy.shape[0]
+    if np.ndim(beamwidth) == 1 and len(beamwidth) != J:
+        raise ValueError('{} beamwidths for {} antennas'.format(len(beamwidth), J))
+    track_xy = propagate_track(antenna_xy, elapsed, out=np.empty((T, J, 2)))
+    signals = np.empty((T,) + np.shape(wavelength) + (J, 1), dtype=dtype)
+    if np.ndim(beamwidth) == 0:
+        antennas = [(slice(0, J), beamwidth)]
+    elif group_beams:
+        antennas = beamwidth_groups(beamwidth)
+    else:
+        antennas = [(slice(j, j+1), bw) for j, bw in enumerate(beamwidth)]
+    for (idx, bw) in antennas:
+        pixeldata = sample_sky(observation, skymap, bw, samples_per_dim, transform_cache)
+        kernel = beam_phase_kernel(bw, samples_per_dim)
+        rngs = None
+        if seeds is not None:
+            rngs = noise_generators(seeds, first_antenna + np.arange(J)[idx][0])
+        signals[..., idx, :] = generate_track_signals(
+            track_xy[:,idx], 
+            kernel.lm, 
+            pixeldata, 
+            wavelength, 
+            snr, 
+            samples, 
+            max_mem=max_mem,
+            dtype=dtype,
+            rngs=rngs,
+            kernel=kernel
+        )
+    return signals, pixeldata
+
+# the sky map loaded by each worker process of `simulate_track`
+_worker_skymap = None
+
+def _init_track_worker(skymap):
+    global _worker_skymap
+    _worker_skymap = skymap
+
+def _track_signals_task(observation, antenna_xy, beamwidth, wavelength, elapsed, kwargs):
+    return simulate_track_signals(
+        observation, 
+        antenna_xy, 
+        beamwidth, 
+        wavelength, 
+        _worker_skymap, 
+        elapsed, 
+        **kwargs
+    )
+
+@PROFILER.timed('simulate')
+def simulate_track(observation, antenna_xy, beamwidth, wavelength, skymap, elapsed, samples_per_dim=64, snr=None, samples=1, transform_cache=TRANSFORM_CACHE, max_mem=TRACK_MAX_MEM, group_beams=False, workers=1, unique=False, dtype=complex, seed=None):
+    """
+    Simulate every time step of an observation with batched array operations.
+
+    Parameters
+    ----------
+    observation : Observation
+        `Observation` object
+
+    antenna_xy : ndarray
+        Jx2 array of antenna (x,y) positions at the start of the track
+
+    beamwidth : float | ndarray
+        antenna beamwidth in degrees shared by all antennas,
+        or J vector of beamwidths to simulate each antenna separately
+
+    wavelength : float | ndarray
+        wavelength in meters, or C vector of channel wavelengths 
+        (see `channel_wavelengths`) to simulate all channels at once
+
+    skymap : SkyMap
+        `SkyMap` object (must be picklable when `workers` > 1)
+
+    elapsed : ndarray
+        T vector of elapsed hours for each time step
+
+    samples_per_dim : int
+        samples per dim of alt/az grid
+
+    snr : float | None
+        signal to noise ratio in dB
 
     samples : int
         samples to use in each short-term interval
 
-    Returns
-    -------
-    signals : ndarray   
-        a JxM matrix of noiseless stacked antenna signals from the skymap
+    transform_cache : LRUCache | None
+        cache for the sky coordinate transforms (see `sample_sky_ra_dec`)
+
+    max_mem : int
+        memory budget in bytes for each batch of the phase matrix
+
+    group_beams : bool
+        simulate antennas with identical beamwidths together 
+        (see `simulate_track_signals`)
+
+    workers : int
+        number of worker processes; time steps (and antennas when 
+        beamwidths differ) are split between them
+
+    unique : bool
+        only return the unique baselines (see `baseline_pairs`)
+
+    dtype : numpy dtype
+        complex dtype of the signals and cross correlations 
+        (see `generate_antenna_signals`)
+
+    seed : int | None
+        seed for the noise; each time step and antenna gets its own
+        stream (see `noise_generators`), so the result does not depend 
+        on `workers`
+
+    Returns
+    -------
+    uv : ndarray
+        T x J^2 x 2 (or T x B x 2) array of baselines for each step,
+        T x C x J^2 x 2 (or T x C x B x 2) with channels
+
+    xcorr : ndarray
+        T x J^2 (or T x B) array of cross correlations for each step,
+        T x C x J^2 (or T x C x B) with channels
+
+    signals : ndarray
+        T x J x 1 (or T x C x J x 1) array of antenna signals for each step
+
+    pixeldata : ndarray
+        samples_per_dim^2 length vector of pixel values
+        (for the last antenna when beamwidths differ)
+    """
+    T, J = len(elapsed), antenna_xy.shape[0]
+    if np.ndim(beamwidth) == 1 and len(beamwidth) != J:
+        raise ValueError('{} beamwidths for {} antennas'.format(len(beamwidth), J))
+    elapsed = np.asarray(elapsed, dtype=float)
+    seeds = noise_seeds(seed, T) if snr else None
+    if workers > 1:
+        kwargs = {
+            'samples_per_dim': samples_per_dim, 
+            'snr': snr, 
+            'samples': samples, 
+            'max_mem': max_mem,
+            'group_beams': group_beams,
+            'dtype': dtype
+        }
+        time_chunks = np.array_split(np.arange(T), min(T, workers))
+        if np.ndim(beamwidth) == 0 or group_beams:
+            antenna_chunks = [np.arange(J)]
+        else:
+            antenna_chunks = np.array_split(np.arange(J), min(J, -(-workers // len(time_chunks))))
+        signals = np.empty((T,) + np.shape(wavelength) + (J, 1), dtype=dtype)
+        with ProcessPoolExecutor(workers, initializer=_init_track_worker, initargs=(skymap,)) as pool:
+            tasks = []
+            for steps in time_chunks:
+                for antennas in antenna_chunks:
+                    bw = beamwidth if np.ndim(beamwidth) == 0 else np.asarray(beamwidth)[antennas]
+                    future = pool.submit(
+                        _track_signals_task, 
+                        observation, 
+                        antenna_xy[antennas], 
+                        bw, 
+                        wavelength, 
+                        elapsed[steps], 
+                        dict(
+                            kwargs, 
+                            seeds=None if seeds is None else [seeds[t] for t in steps], 
+                            first_antenna=antennas[0]
+                        )
+                    )
+                    tasks.append((steps, antennas, future))
+            # merge by index so the result does not depend on completion order
+            for (steps, antennas, future) in tasks:
+                chunk, chunk_pixeldata = future.result()
+                signals[steps[0]:steps[-1]+1, ..., antennas[0]:antennas[-1]+1, :] = chunk
+                if antennas[-1] == J - 1:
+                    pixeldata = chunk_pixeldata
+    else:
+        signals, pixeldata = simulate_track_signals(
+            observation, 
+            antenna_xy, 
+            beamwidth, 
+            wavelength, 
+            skymap, 
+            elapsed, 
+            samples_per_dim, 
+            snr, 
+            samples, 
+            transform_cache, 
+            max_mem,
+            group_beams,
+            dtype,
+            seeds
+        )
+
+    uv, xcorr = track_visibilities(antenna_xy, elapsed, wavelength, signals, unique)
+    return uv, xcorr, signals, pixeldata
+
+def iter_track(observation, antenna_xy, beamwidth, wavelength, skymap, elapsed, samples_per_dim=64, snr=None, samples=1, transform_cache=TRANSFORM_CACHE, max_mem=TRACK_MAX_MEM, group_beams=False, workers=1, block=1, unique=False, dtype=complex, seed=None):
+    """
+    Simulate an observation like `simulate_track`, yielding the time steps
+    in order, `block` steps at a time, as soon as they are ready. Closing
+    the generator early cancels the steps that have not started.
+
+    Parameters
+    ----------
+    observation, antenna_xy, beamwidth, wavelength, skymap, elapsed, 
+    samples_per_dim, snr, samples, transform_cache, max_mem, group_beams, 
+    unique, dtype, seed :
+        see `simulate_track`
+
+    workers : int
+        number of worker processes; blocks are handed out to them in order
+
+    block : int
+        number of time steps in each block
+
+    Yields
+    ------
+    steps : ndarray
+        indices into `elapsed` of the steps in the block
+
+    uv : ndarray
+        array of baselines for each step in the block 
+        (see `simulate_track`)
+
+    xcorr : ndarray
+        array of cross correlations for each step in the block
+
+    signals : ndarray
+        array of antenna signals for each step in the block
+
+    pixeldata : ndarray
+        samples_per_dim^2 length vector of pixel values
+        (for the last antenna when beamwidths differ)
+    """
+    elapsed = np.asarray(elapsed, dtype=float)
+    blocks = [np.arange(start, min(start + block, len(elapsed))) for start in range(0, len(elapsed), block)]
+    seeds = noise_seeds(seed, len(elapsed)) if snr else None
+    block_seeds = lambda steps: None if seeds is None else [seeds[t] for t in steps]
+    kwargs = {
+        'samples_per_dim': samples_per_dim, 
+        'snr': snr, 
+        'samples': samples, 
+        'max_mem': max_mem,
+        'group_beams': group_beams,
+        'dtype': dtype
+    }
+    if workers > 1:
+        pool = ProcessPoolExecutor(workers, initializer=_init_track_worker, initargs=(skymap,))
+        futures = [
+            pool.submit(
+                _track_signals_task, 
+                observation, 
+                antenna_xy, 
+                beamwidth, 
+                wavelength, 
+                elapsed[steps], 
+                dict(kwargs, seeds=block_seeds(steps))
+            )
+            for steps in blocks
+        ]
+        results = (future.result() for future in futures)
+    else:
+        futures = []
+        results = (
+            simulate_track_signals(
+                observation, 
+                antenna_xy, 
+                beamwidth, 
+                wavelength, 
+                skymap, 
+                elapsed[steps], 
+                transform_cache=transform_cache, 
+                seeds=block_seeds(steps),
+                **kwargs
+            ) 
+            for steps in blocks
+        )
+    try:
+        for steps in blocks:
+            with PROFILER.step(int(steps[0])):
+                signals, pixeldata = next(results)
+                uv, xcorr = track_visibilities(antenna_xy, elapsed[steps], wavelength, signals, unique)
+            yield steps, uv, xcorr, signals, pixeldata
+    finally:
+        if workers > 1:
+            for future in futures:
+                future.cancel()
+            pool.shutdown()
+
+@PROFILER.timed('correlate')
+def track_visibilities(antenna_xy, elapsed, wavelength, signals, unique=False):
+    """
+    Parameters
+    ----------
+    antenna_xy : ndarray
+        Jx2 array of antenna (x,y) positions at the start of the track
+
+    elapsed : ndarray
+        T vector of elapsed hours for each time step
+
+    wavelength : float | ndarray
+        wavelength in meters, or C vector of channel wavelengths
+
+    signals : ndarray
+        T x J x 1 (or T x C x J x 1) array of antenna signals for each 
+        step (the outputs have the same precision)
+
+    unique : bool
+        only return the unique baselines (see `baseline_pairs`)
+
+    Returns
+    -------
+    uv : ndarray
+        T x J^2 x 2 (or T x B x 2) array of baselines for each step,
+        T x C x J^2 x 2 (or T x C x B x 2) with channels
+
+    xcorr : ndarray
+        T x J^2 (or T x B) array of cross correlations for each step,
+        T x C x J^2 (or T x C x B) with channels
+    """
+    T, J = len(elapsed), antenna_xy.shape[0]
+    real = real_dtype(signals.dtype)
+    track_xy = propagate_track(antenna_xy, elapsed, out=np.empty((T, J, 2)))
+    channels = np.shape(wavelength)
+    if channels:
+        # the baselines in meters are shared, only their scale changes
+        baselines = to_uv_track(track_xy, 1.0, unique=unique)
+        uv = (baselines[:,np.newaxis] / np.reshape(wavelength, (-1, 1, 1))).astype(real)
+        xcorr = xcorr_track(signals.reshape((-1,) + signals.shape[-2:]), unique=unique)
+        return uv, xcorr.reshape(T, channels[0], -1)
+    if unique:
+        B = J*(J - 1) // 2
+        uv = to_uv_track(track_xy, wavelength, out=np.empty((T, B, 2), dtype=real), unique=True)
+        xcorr = xcorr_track(signals, out=np.empty((T, B), dtype=signals.dtype), unique=True)
+        return uv, xcorr
+    uv = to_uv_track(track_xy, wavelength, out=np.empty((T, J*J, 2), dtype=real))
+    xcorr = np.empty((T, J*J), dtype=signals.dtype)
+    xcorr_track(signals, out=xcorr.reshape(T, J, J))
+    return uv, xcorr
+
+def parse_memory_size(size):
+    """
+    Parameters
+    ----------
+    size : str | int
+        memory size in bytes or with a K, M or G suffix (e.g. "2G")
+
+    Returns
+    -------
+    nbytes : int
+        memory size in bytes
+    """
+    if isinstance(size, (int, np.integer)):
+        return int(size)
+    size = size.strip().upper().rstrip('B')
+    scale = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+    if size and size[-1] in scale:
+        return int(float(size[:-1])*scale[size[-1]])
+    return int(float(size))
+
+def lm_grid_axes(lm):
+    """
+    Parameters
+    ----------
+    lm : ndarray
+        N^2 x 2 matrix of (l,m) points
+
+    Returns
+    -------
+    l_axis : ndarray
+        unique l values
+
+    l_index : ndarray
+        index into `l_axis` for each point
+
+    m_axis : ndarray
+        unique m values
+
+    m_index : ndarray
+        index into `m_axis` for each point
+    """
+    l_axis, l_index = np.unique(lm[:,0], return_inverse=True)
+    m_axis, m_index = np.unique(lm[:,1], return_inverse=True)
+    return l_axis, l_index.reshape(-1), m_axis, m_index.reshape(-1)
+
+def compute_dirty_image_pixels(xcorr, uv, lm, max_mem=None, dtype=complex, phase_kernel=None):
+    """
+    Parameters
+    ----------
+    xcorr : ndarray
+        J^2 vector of antenna signal cross correlations
+
+    uv    : ndarray
+        J^2 x 2 matrix of baseline vectors
+
+    lm    : ndarray
+        N^2 x 2 matrix of (l,m) points
+
+    max_mem : str | int | None
+        memory budget for the phase matrix (see `parse_memory_size`),
+        or None to evaluate it all at once
+
+    dtype : numpy dtype
+        complex dtype of the phase matrix and the result
+        (`np.complex64` halves the memory of double precision)
+
+    phase_kernel : PhaseKernel | None
+        phase kernel of `lm` (see `beam_phase_kernel`), by default built
+        from `lm`; on a grid the image is a product of per-axis factors
+        (see `PhaseKernel.image`) and no V x N^2 phase matrix is formed
+
+    Returns
+    -------
+    pixelvalues : ndarray
+        N^2 vector of s plane pixel values
+    """
+    phase_kernel = PhaseKernel(lm) if phase_kernel is None else phase_kernel
+    if phase_kernel.separable:
+        budget = None if max_mem is None else parse_memory_size(max_mem)
+        return phase_kernel.image(xcorr, uv, dtype, budget).reshape(1, -1)
+    if max_mem is not None:
+        return compute_dirty_image_pixels_chunked(xcorr, uv, lm, parse_memory_size(max_mem), dtype)
+    real = real_dtype(dtype)
+    zdots = uv.astype(real).dot(lm.T.astype(real))
+    xcorr = np.asarray(xcorr, dtype=dtype)
+    result = xcorr.reshape(1,xcorr.shape[0]).dot(expi(2*np.pi*zdots))
+    return result
+
+def compute_dirty_image_pixels_chunked(xcorr, uv, lm, max_mem, dtype=complex):
+    """
+    Evaluate `compute_dirty_image_pixels` in visibility x pixel blocks
+    that fit in `max_mem` bytes, for points that do not lie on a grid
+    (grids are imaged from per-axis factors by `PhaseKernel.image`).
+
+    Parameters
+    ----------
+    xcorr : ndarray
+        J^2 vector of antenna signal cross correlations
+
+    uv    : ndarray
+        J^2 x 2 matrix of baseline vectors
+
+    lm    : ndarray
+        N^2 x 2 matrix of (l,m) points
+
+    max_mem : int
+        memory budget in bytes
+
+    dtype : numpy dtype
+        complex dtype of the phase factors and the result
+
+    Returns
+    -------
+    pixelvalues : ndarray
+        N^2 vector of s plane pixel values
+    """
+    real = real_dtype(dtype)
+    xcorr = np.asarray(xcorr, dtype=dtype).reshape(-1)
+    uv, lm = uv.astype(real), lm.astype(real)
+    V, P = uv.shape[0], lm.shape[0]
+    # the phases and their exp
+    elements = max(1, max_mem // (2*np.dtype(dtype).itemsize))
+    pixel_block = min(P, elements)
+    vis_block = max(1, min(V, elements // pixel_block))
+
+    result = np.zeros((1, P), dtype=dtype)
+    for vstart in range(0, V, vis_block):
+        vuv = uv[vstart:vstart+vis_block]
+        vx = xcorr[vstart:vstart+vis_block]
+        for pstart in range(0, P, pixel_block):
+            pend = pstart + pixel_block
+            phases = expi(2*np.pi*vuv.dot(lm[pstart:pend].T))
+            result[0, pstart:pend] += vx.dot(phases)
+    return result
+
+GRIDDING_KERNELS = ('kaiser-bessel', 'gaussian', 'nearest')
+
+def gridding_kernel(offsets, kernel='kaiser-bessel', support=6, oversample=2):
+    """
+    Parameters
+    ----------
+    offsets : ndarray
+        distances from the visibility to the grid cells in cells
+
+    kernel : str
+        one of `GRIDDING_KERNELS`
+
+    support : int
+        full width of the kernel in cells
+
+    oversample : float
+        grid oversampling factor (used to tune the Kaiser-Bessel shape)
+
+    Returns
+    -------
+    weights : ndarray
+        kernel weights with the same shape as `offsets`
+    """
+    offsets = np.asarray(offsets, dtype=float)
+    if kernel == 'nearest':
+        return ((offsets >= -0.5) & (offsets < 0.5)).astype(float)
+    inside = np.abs(offsets) <= support / 2
+    if kernel == 'gaussian':
+        sigma = support / 7
+        return np.where(inside, np.exp(-offsets**2 / (2*sigma**2)), 0.0)
+    if kernel == 'kaiser-bessel':
+        # shape parameter from Beatty et al. (2005) for the given oversampling
+        beta = np.pi*np.sqrt((support/oversample)**2 * (oversample - 0.5)**2 - 0.8)
+        arg = 1 - (2*offsets/support)**2
+        return np.where(inside, np.i0(beta*np.sqrt(np.clip(arg, 0, None))) / np.i0(beta), 0.0)
+    raise ValueError('unknown gridding kernel "{}"'.format(kernel))
+
+def kernel_taps(cells, gridsize, kernel='kaiser-bessel', support=6, oversample=2):
+    """
+    Parameters
+    ----------
+    cells : ndarray
+        V x 2 matrix of (u,v) positions in grid cells
+
+    gridsize : int
+        number of cells per grid dimension (the grid wraps around)
+
+    kernel : str
+        one of `GRIDDING_KERNELS`
+
+    support : int
+        full width of the kernel in cells
+
+    oversample : float
+        grid oversampling factor
+
+    Returns
+    -------
+    idx : ndarray
+        V x W x W flat grid index of each kernel tap
+
+    weights : ndarray
+        V x W x W kernel weight of each tap
+    """
+    if kernel == 'nearest':
+        support = 1
+    M = gridsize
+    taps = np.arange(support)
+    first = np.ceil(cells - support/2).astype(int)
+    iu = first[:,0,None] + taps
+    iv = first[:,1,None] + taps
+    wu = gridding_kernel(iu - cells[:,0,None], kernel, support, oversample)
+    wv = gridding_kernel(iv - cells[:,1,None], kernel, support, oversample)
+    idx = (iv[:,:,None] % M)*M + (iu[:,None,:] % M)
+    return idx, wv[:,:,None]*wu[:,None,:]
+
+def grid_visibilities(xcorr, uv, cellsize, gridsize, kernel='kaiser-bessel', support=6, oversample=2, chunk=65536, dtype=complex):
+    """
+    Convolutionally grid visibilities onto a regular uv grid.
+
+    Parameters
+    ----------
+    xcorr : ndarray
+        V vector of visibilities
+
+    uv : ndarray
+        V x 2 matrix of (u,v) baselines in wavelengths
+
+    cellsize : float
+        uv grid cell size in wavelengths
+
+    gridsize : int
+        number of cells per grid dimension (the grid wraps around)
+
+    kernel : str
+        one of `GRIDDING_KERNELS`
+
+    support : int
+        full width of the kernel in cells
+
+    oversample : float
+        grid oversampling factor
+
+    chunk : int
+        number of visibilities to grid at once
+
+    dtype : numpy dtype
+        complex dtype of the kernel-weighted visibilities and the grid
+
+    Returns
+    -------
+    grid : ndarray
+        gridsize x gridsize complex grid indexed as [v, u]
+    """
+    xcorr = np.asarray(xcorr, dtype=dtype).reshape(-1)
+    M = gridsize
+    grid_re = np.zeros(M*M)
+    grid_im = np.zeros(M*M)
+    for start in range(0, xcorr.shape[0], chunk):
+        idx, weights = kernel_taps(uv[start:start+chunk] / cellsize, M, kernel, support, oversample)
+        values = xcorr[start:start+chunk,None,None]*weights.astype(real_dtype(dtype))
+        grid_re += np.bincount(idx.reshape(-1), values.real.reshape(-1), minlength=M*M)
+        grid_im += np.bincount(idx.reshape(-1), values.imag.reshape(-1), minlength=M*M)
+    return (grid_re + 1j*grid_im).reshape(M, M).astype(dtype)
+
+def degrid_visibilities(grid, uv, cellsize, kernel='kaiser-bessel', support=6, oversample=2, chunk=65536):
+    """
+    Interpolate visibilities from a regular uv grid (the inverse of 
+    `grid_visibilities`).
+
+    Parameters
+    ----------
+    grid : ndarray
+        M x M complex grid indexed as [v, u]
+
+    uv : ndarray
+        V x 2 matrix of (u,v) baselines in wavelengths
+
+    cellsize : float
+        uv grid cell size in wavelengths
+
+    kernel : str
+        one of `GRIDDING_KERNELS`
+
+    support : int
+        full width of the kernel in cells
+
+    oversample : float
+        grid oversampling factor
+
+    chunk : int
+        number of visibilities to interpolate at once
+
+    Returns
+    -------
+    xcorr : ndarray
+        V vector of interpolated visibilities
+    """
+    M = grid.shape[0]
+    flat = grid.reshape(-1)
+    xcorr = np.empty(uv.shape[0], dtype=complex)
+    for start in range(0, uv.shape[0], chunk):
+        idx, weights = kernel_taps(uv[start:start+chunk] / cellsize, M, kernel, support, oversample)
+        xcorr[start:start+chunk] = np.sum(flat[idx]*weights, axis=(1, 2))
+    return xcorr
+
+def grid_correction(pixels, gridsize, kernel='kaiser-bessel', support=6, oversample=2):
+    """
+    Parameters
+    ----------
+    pixels : ndarray
+        pixel offsets from the image center
+
+    gridsize : int
+        number of cells per grid dimension
+
+    kernel : str
+        one of `GRIDDING_KERNELS`
+
+    support : int
+        full width of the kernel in cells
+
+    oversample : float
+        grid oversampling factor
+
+    Returns
+    -------
+    correction : ndarray
+        Fourier transform of the kernel at each pixel offset
+    """
+    if kernel == 'nearest':
+        return np.sinc(pixels / gridsize)
+    d = np.linspace(-support/2, support/2, 64*support + 1)
+    w = gridding_kernel(d, kernel, support, oversample)
+    w[[0, -1]] *= 0.5
+    phase = 2*np.pi*np.outer(pixels, d) / gridsize
+    return np.cos(phase).dot(w)*(d[1] - d[0])
+
+def compute_dirty_image_fft(uv, xcorr, imwidth, samples_per_dim, kernel='kaiser-bessel', support=6, oversample=2, dtype=complex):
+    """
+    Approximate `compute_dirty_image` with convolutional gridding and an FFT.
+
+    Parameters
+    ----------
+    uv : ndarray
+        V x 2 matrix of (u,v) baselines
+
+    xcorr : ndarray
+        V x 1 matrix of cross correlations
+
+    imwidth : float
+        image beamwidth in degrees
+
+    samples_per_dim : int
+        samples per dimension of the image
+
+    kernel : str
+        one of `GRIDDING_KERNELS`
+
+    support : int
+        full width of the kernel in cells
+
+    oversample : float
+        grid oversampling factor
+
+    dtype : numpy dtype
+        complex dtype of the gridded visibilities and the image
+
+    Returns
+    -------
+    image : ndarray
+        (samples_per_dim x samples_per_dim) dirty image
+    """
+    N = samples_per_dim
+    M, cellsize, shift = fft_grid_geometry(imwidth, N, oversample)
+    # the phase shift at the working precision, so single precision stays single
+    shifted = expi(-2*np.pi*shift*uv.sum(axis=1, dtype=real_dtype(dtype)))
+    shifted *= np.asarray(xcorr).reshape(-1)
+    xcorr = shifted
+    grid = grid_visibilities(xcorr, uv, cellsize, M, kernel, support, oversample, dtype=dtype)
+    return image_from_grid(grid, N, kernel, support, oversample, dtype)
+
+def image_from_grid(grid, samples_per_dim, kernel='kaiser-bessel', support=6, oversample=2, dtype=complex):
+    """
+    Parameters
+    ----------
+    grid : ndarray
+        M x M complex grid from `grid_visibilities` (or K x M x M 
+        for K images at once)
+
+    samples_per_dim : int
+        samples per dimension of the image
+
+    kernel : str
+        kernel the grid was made with (see `GRIDDING_KERNELS`)
+
+    support : int
+        full width of the kernel in cells
+
+    oversample : float
+        grid oversampling factor
+
+    dtype : numpy dtype
+        complex dtype of the image
+
+    Returns
+    -------
+    image : ndarray
+        (samples_per_dim x samples_per_dim) grid-corrected image 
+        (K x samples_per_dim x samples_per_dim for K grids)
+    """
+    N, M = samples_per_dim, grid.shape[-1]
+    # move the grid origin so the FFT output is centered on pixel M/2
+    checker = (-1)**np.add.outer(np.arange(M), np.arange(M))
+    image = np.fft.ifft2(grid*checker)*(M*M)
+    lo = M//2 - N//2
+    image = image[..., lo:lo+N, lo:lo+N]
+    correction = grid_correction(np.arange(N) - N//2, M, kernel, support, oversample)
+    return (image / np.outer(correction, correction)).astype(dtype)
+
+def fft_grid_geometry(imwidth, samples_per_dim, oversample=2):
+    """
+    Parameters
+    ----------
+    imwidth : float
+        image beamwidth in degrees
+
+    samples_per_dim : int
+        samples per dimension of the image
+
+    oversample : float
+        grid oversampling factor
+
+    Returns
+    -------
+    gridsize : int
+        (even) number of uv cells per grid dimension
+
+    cellsize : float
+        uv cell size in wavelengths
+
+    shift : float
+        offset in l and m between the image center and pixel N//2
+        (half a pixel for odd N, where the DFT grid is centered on N/2)
+    """
+    N = samples_per_dim
+    M = int(np.ceil(oversample*N/2))*2
+    dl = imwidth / 90 / N
+    return M, 1 / (M*dl), (N/2 - N//2)*dl
+
+def predict_visibilities(model, uv, imwidth, method='dft', kernel='kaiser-bessel', support=6, oversample=2, chunk=65536):
+    """
+    Predict the visibilities of a model image (the inverse of 
+    `compute_dirty_image` up to the PSF).
+
+    Parameters
+    ----------
+    model : ndarray
+        NxN model image, e.g. CLEAN components
+
+    uv : ndarray
+        V x 2 matrix of (u,v) baselines
+
+    imwidth : float
+        image beamwidth in degrees
+
+    method : str
+        "dft" to sum the nonzero model pixels directly or "fft" to 
+        degrid an FFT of the model
+
+    kernel : str
+        one of `GRIDDING_KERNELS` for the fft method
+
+    support : int
+        full width of the kernel in cells
+
+    oversample : float
+        grid oversampling factor
+
+    chunk : int
+        number of visibilities to evaluate at once
+
+    Returns
+    -------
+    xcorr : ndarray
+        V vector of model visibilities
+    """
+    N = model.shape[0]
+    if method == 'dft':
+        idx = np.flatnonzero(model)
+        lm = create_antenna_beam_lm_samples(imwidth, N, LM_GRID_CACHE)[idx]
+        flux = model.reshape(-1)[idx]
+        xcorr = np.empty(uv.shape[0], dtype=complex)
+        for start in range(0, uv.shape[0], chunk):
+            xcorr[start:start+chunk] = np.exp(-1j*2*np.pi*uv[start:start+chunk].dot(lm.T)).dot(flux)
+        return xcorr
+    if method != 'fft':
+        raise ValueError('unknown imaging method "{}"'.format(method))
+    M, cellsize, shift = fft_grid_geometry(imwidth, N, oversample)
+    correction = grid_correction(np.arange(N) - N//2, M, kernel, support, oversample)
+    padded = np.zeros((M, M), dtype=complex)
+    lo = M//2 - N//2
+    padded[lo:lo+N, lo:lo+N] = model / np.outer(correction, correction)
+    checker = (-1)**np.add.outer(np.arange(M), np.arange(M))
+    grid = np.fft.fft2(padded)*checker
+    xcorr = degrid_visibilities(grid, uv, cellsize, kernel, support, oversample, chunk)
+    return xcorr*np.exp(1j*2*np.pi*shift*uv.sum(axis=1))
+
+IMAGING_METHODS = ('dft', 'fft')
+
+@PROFILER.timed('imaging')
+def compute_dirty_image(uv, xcorr, imwidth, samples_per_dim, method='dft', hermitian=False, zero_spacing=0.0, weights=None, **kwargs):
+    """
+    Parameters
+    ----------
+    uv : ndarray
+        J^2 x 2 matrix of (u,v) baselines
+
+    xcorr : ndarray
+        J^2 x 1 matrix of cross correlations
+
+    imwidth : float
+        image beamwidth in degrees
+    
+    samples_per_dim : int
+        samples per dimension of the image
+
+    method : str
+        "dft" for the direct transform or "fft" for gridding + FFT
+
+    hermitian : bool
+        the visibilities are unique baselines (see `baseline_pairs`); 
+        their conjugates at -uv are added analytically, which makes 
+        the image real
+
+    zero_spacing : float
+        sum of the autocorrelations to add to every pixel of a 
+        hermitian image (see `autocorrelation_sum`), or 0 to leave them out
+
+    weights : ndarray | None
+        J^2 vector of visibility weights, e.g. the number of redundant
+        baselines merged into each (see `average_redundant_baselines`)
+
+    kwargs : 
+        extra options for the imaging backend (see 
+        `compute_dirty_image_pixels` and `compute_dirty_image_fft`)
+
+    Returns
+    -------
+    image : ndarray
+        (samples_per_dim x samples_per_dim) dirty image
+    """
+    if weights is not None:
+        dtype = kwargs.get('dtype', complex)
+        xcorr = np.asarray(xcorr, dtype=dtype).reshape(-1)*np.asarray(weights, dtype=real_dtype(dtype))
+    if method == 'fft':
+        image = compute_dirty_image_fft(uv, xcorr, imwidth, samples_per_dim, **kwargs)
+    elif method == 'dft':
+        phase_kernel = beam_phase_kernel(imwidth, samples_per_dim)
+        image = compute_dirty_image_pixels(xcorr, uv, phase_kernel.lm, phase_kernel=phase_kernel, **kwargs)
+        image = image.reshape(samples_per_dim, samples_per_dim)
+    else:
+        raise ValueError('unknown imaging method "{}"'.format(method))
+    if hermitian:
+        return 2*image.real + zero_spacing
+    return image
+
+# `compute_dirty_image` outside the 'imaging' stage, for the dirty beam and
+# the CLEAN major cycles, which are profiled as stages of their own
+_dirty_image = compute_dirty_image.__wrapped__
+
+class IncrementalImager(object):
+    """
+    A dirty image that is updated as visibilities arrive. Imaging is 
+    linear in the visibilities, so each `add` only transforms the new
+    ones: the dft method accumulates image pixels and the fft method 
+    accumulates the uv grid, which is transformed when the image is read.
+    """
+    def __init__(self, imwidth, samples_per_dim, method='dft', hermitian=False, **kwargs):
+        """
+        Parameters
+        ----------
+        imwidth : float
+            image beamwidth in degrees
+
+        samples_per_dim : int
+            samples per dimension of the image
+
+        method : str
+            one of `IMAGING_METHODS`
+
+        hermitian : bool
+            the visibilities are unique baselines (see `compute_dirty_image`)
+
+        kwargs :
+            extra options for the imaging backend (see `compute_dirty_image`)
+        """
+        if method not in IMAGING_METHODS:
+            raise ValueError('unknown imaging method "{}"'.format(method))
+        self.imwidth = imwidth
+        self.samples_per_dim = samples_per_dim
+        self.method = method
+        self.hermitian = hermitian
+        self.kwargs = kwargs
+        self.count = 0
+        self.zero_spacing = 0.0
+        N = samples_per_dim
+        if method == 'dft':
+            self._phase_kernel = beam_phase_kernel(imwidth, N)
+            self._pixels = np.zeros(N*N, dtype=kwargs.get('dtype', complex))
+        else:
+            oversample = kwargs.get('oversample', 2)
+            M, self._cellsize, self._shift = fft_grid_geometry(imwidth, N, oversample)
+            self._grid = np.zeros((M, M), dtype=kwargs.get('dtype', complex))
+
+    @PROFILER.timed('imaging')
+    def add(self, uv, xcorr, zero_spacing=0.0, weights=None):
+        """
+        Parameters
+        ----------
+        uv : ndarray
+            V x 2 matrix of new (u,v) baselines
+
+        xcorr : ndarray
+            V vector of their cross correlations
 
-    pixeldata : ndarray
-        samples_per_dim^2 length vector of pixel values
-    """
-    target_alt_az = observation.alt_az().squeeze()
-    alt_az_samples = generate_alt_az_samples(
-        beamwidth, 
-        target_alt_az[0], 
-        target_alt_az[1],
-        samples_per_dim
-    )
-    ra_dec_samples = convert_alt_az_to_ra_dec(
-        alt_az_samples, 
-        observation.lat, 
-        observation.lon, 
-        observation.timestamp
-    )
-    pixeldata = skymap.get_temp_mk(ra_dec_samples)
-    beamsamples = create_antenna_beam_lm_samples(
-        beamwidth, 
-        samples_per_dim=samples_per_dim
-    )
-    rx = generate_antenna_signals(axy, beamsamples, pixeldata, wavelength, snr, samples)
-    return rx, pixeldata
+        zero_spacing : float
+            sum of their autocorrelations for a hermitian image
+
+        weights : ndarray | None
+            V vector of their weights (see `compute_dirty_image`)
+        """
+        self.zero_spacing += zero_spacing
+        dtype = self.kwargs.get('dtype', complex)
+        real = real_dtype(dtype)
+        xcorr = np.asarray(xcorr, dtype=dtype).reshape(-1)
+        if weights is not None:
+            xcorr = xcorr*np.asarray(weights, dtype=real)
+        if self.method == 'dft':
+            self._pixels += compute_dirty_image_pixels(xcorr, uv, self._phase_kernel.lm, phase_kernel=self._phase_kernel, **self.kwargs).reshape(-1)
+        else:
+            xcorr = xcorr*expi(-2*np.pi*self._shift*uv.sum(axis=1, dtype=real))
+            self._grid += grid_visibilities(xcorr, uv, self._cellsize, self._grid.shape[0], **self.kwargs)
+        self.count += xcorr.shape[0]
+
+    def image(self):
+        """
+        Returns
+        -------
+        image : ndarray
+            (samples_per_dim x samples_per_dim) dirty image of all 
+            visibilities added so far (see `compute_dirty_image`)
+        """
+        N = self.samples_per_dim
+        if self.method == 'dft':
+            image = self._pixels.reshape(N, N).copy()
+        else:
+            image = image_from_grid(self._grid, N, **self.kwargs)
+        if self.hermitian:
+            return 2*image.real + self.zero_spacing
+        return image
 
-def compute_dirty_image_pixels(xcorr, uv, lm):
+def image_error(reference, image):
     """
     Parameters
     ----------
-    xcorr : ndarray
-        J^2 vector of antenna signal cross correlations
-
-    uv    : ndarray
-        J^2 x 2 matrix of baseline vectors
+    reference : ndarray
+        reference image (e.g. from the DFT imager)
 
-    lm    : ndarray
-        N^2 x 2 matrix of (l,m) points
+    image : ndarray
+        image to compare against the reference
 
     Returns
     -------
-    pixelvalues : ndarray
-        N^2 vector of s plane pixel values
+    errors : dict
+        maximum absolute error, RMS error and maximum error 
+        relative to the reference peak
     """
-    zdots = uv.dot(lm.T)
-    result = xcorr.reshape(1,xcorr.shape[0]).dot(np.exp(1j*2*np.pi*zdots))
-    return result
-
-def compute_dirty_image(uv, xcorr, imwidth, samples_per_dim):
+    diff = np.abs(np.asarray(image) - np.asarray(reference))
+    peak = np.amax(np.abs(reference))
+    return {
+        'max_abs': float(np.amax(diff)),
+        'rms': float(np.sqrt(np.mean(diff**2))),
+        'max_rel': float(np.amax(diff) / peak) if peak > 0 else float('inf'),
+    }
+
+def check_imager(uv, xcorr, imwidth, samples_per_dim, method='fft', hermitian=False, zero_spacing=0.0, weights=None, **kwargs):
     """
+    Compare an imaging backend against the direct DFT.
+
     Parameters
     ----------
     uv : ndarray
@@ -454,20 +2654,155 @@ def compute_dirty_image(uv, xcorr, imwidth, samples_per_dim):
 
     imwidth : float
         image beamwidth in degrees
-    
+
     samples_per_dim : int
         samples per dimension of the image
 
+    method : str
+        imaging method to check
+
+    hermitian, zero_spacing, weights :
+        see `compute_dirty_image`
+
     Returns
     -------
-    image : ndarray
-        (samples_per_dim x samples_per_dim) dirty image
+    errors : dict
+        see `image_error`
+    """
+    reference = compute_dirty_image(uv, xcorr, imwidth, samples_per_dim, 'dft', hermitian, zero_spacing, weights)
+    image = compute_dirty_image(uv, xcorr, imwidth, samples_per_dim, method, hermitian, zero_spacing, weights, **kwargs)
+    return image_error(reference, image)
+
+class PSFCache(object):
+    """ 
+    Dirty beams kept in an in-memory LRU cache and, when a directory is 
+    set, in .npy files there that outlive the process. The files are 
+    evicted oldest-used first to stay within `max_bytes`.
+    """
+    def __init__(self, maxsize=16, directory=None, max_bytes=2**28):
+        """
+        Parameters
+        ----------
+        maxsize : int
+            maximum number of dirty beams to keep in memory
+
+        directory : str | None
+            directory for the cache files, or None to only cache in memory
+
+        max_bytes : int | str
+            maximum total size of the cache files (see `parse_memory_size`)
+        """
+        self.memory = LRUCache(maxsize)
+        self.directory = directory
+        self.max_bytes = parse_memory_size(max_bytes)
+        self.disk_hits = 0
+
+    def get(self, key, compute):
+        """
+        Parameters
+        ----------
+        key : str
+            cache key (see `psf_cache_key`)
+
+        compute : callable
+            called with no arguments to produce the dirty beam on a miss
+
+        Returns
+        -------
+        psf : ndarray
+            the cached or newly computed dirty beam (read-only, as it 
+            is shared between callers)
+        """
+        return self.memory.get(key, lambda: self._load(key, compute))
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def _load(self, key, compute):
+        if self.directory is not None:
+            try:
+                psf = np.load(self._path(key))
+                # the file modification time marks when it was last used
+                os.utime(self._path(key))
+                self.disk_hits += 1
+            except (OSError, ValueError):
+                psf = None
+            if psf is not None:
+                psf.flags.writeable = False
+                return psf
+        psf = compute()
+        psf.flags.writeable = False
+        if self.directory is not None:
+            self._store(key, psf)
+        return psf
+
+    def _store(self, key, psf):
+        os.makedirs(self.directory, exist_ok=True)
+        # write then rename, so other processes never load a partial file
+        partial = self._path(key) + '.partial'
+        with open(partial, 'wb') as f:
+            np.save(f, psf)
+        os.replace(partial, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for (_, size, _) in files)
+        for (_, size, path) in sorted(files):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        """ Drop the in-memory entries and reset the counters; the files are kept. """
+        self.memory.clear()
+        self.disk_hits = 0
+
+    def info(self):
+        """
+        Returns
+        -------
+        info : dict
+            in-memory hits, misses, size and maximum size (see 
+            `LRUCache.info`) and the hits loaded from disk
+        """
+        return dict(self.memory.info(), disk_hits=self.disk_hits)
+
+def psf_cache_key(uvs, beamwidth, samples_per_dim, method, hermitian, zero_spacing, weights, kwargs):
     """
-    lm = create_antenna_beam_lm_samples(imwidth, samples_per_dim)
-    image = compute_dirty_image_pixels(xcorr, uv, lm)
-    return image.reshape(samples_per_dim, samples_per_dim)
+    Parameters
+    ----------
+    uvs, beamwidth, samples_per_dim, method, hermitian, zero_spacing, 
+    weights, kwargs :
+        arguments of `dirty_beam`
 
-def dirty_beam(uvs, beamwidth, samples_per_dim):
+    Returns
+    -------
+    key : str
+        hex digest identifying the dirty beam of this uv coverage
+    """
+    digest = hashlib.sha1()
+    uvs = np.ascontiguousarray(uvs)
+    digest.update(str(uvs.shape).encode())
+    digest.update(uvs.dtype.str.encode())
+    digest.update(uvs.tobytes())
+    if weights is not None:
+        digest.update(np.ascontiguousarray(weights, dtype=float).tobytes())
+    options = (float(beamwidth), int(samples_per_dim), method, bool(hermitian), float(zero_spacing), sorted(kwargs.items()))
+    digest.update(repr(options).encode())
+    return digest.hexdigest()
+
+# dirty beams of recent uv coverages, shared by all `dirty_beam` calls
+PSF_CACHE = PSFCache()
+
+@PROFILER.timed('dirty_beam')
+def dirty_beam(uvs, beamwidth, samples_per_dim, method='dft', hermitian=False, zero_spacing=0.0, weights=None, cache=PSF_CACHE, **kwargs):
     """
     Parameters
     ----------
@@ -480,18 +2815,269 @@ def dirty_beam(uvs, beamwidth, samples_per_dim):
     samples_per_dim : int
         samples per dimension for beam image
 
+    method : str
+        imaging method (see `compute_dirty_image`)
+
+    hermitian : bool
+        `uvs` are unique baselines (see `compute_dirty_image`)
+
+    zero_spacing : float
+        number of autocorrelations to include in a hermitian beam
+
+    weights : ndarray | None
+        visibility weights (see `compute_dirty_image`)
+
+    cache : PSFCache | None
+        cache for the dirty beams of repeated uv coverages, or None
+
     Returns
     -------
     dirty_beam : ndarray
-        samples_per_dim x samples_per_dim dirty beam
+        samples_per_dim x samples_per_dim dirty beam (read-only when cached)
     """
     N = samples_per_dim
-    dirty = compute_dirty_image(uvs, np.ones(uvs.shape[0]), beamwidth, N)
-    dirty = np.abs(dirty)
-    dirty /= np.amax(dirty)
-    return dirty
+    def compute():
+        sampling = np.ones(uvs.shape[0]) if weights is None else weights
+        dirty = _dirty_image(uvs, sampling, beamwidth, N, method, hermitian, zero_spacing, **kwargs)
+        dirty = np.abs(dirty)
+        dirty /= np.amax(dirty)
+        return dirty
+    if cache is None:
+        return compute()
+    key = psf_cache_key(uvs, beamwidth, N, method, hermitian, zero_spacing, weights, kwargs)
+    return cache.get(key, compute)
+
+def layout_uv_tracks(layouts, elapsed, wavelength):
+    """
+    Parameters
+    ----------
+    layouts : ndarray
+        K x J x 2 array of candidate antenna (x,y) positions
+
+    elapsed : ndarray
+        T vector of elapsed hours for each time step
+
+    wavelength : float
+        wavelength in meters
+
+    Returns
+    -------
+    uvs : ndarray
+        K x (T*B) x 2 array of the unique baselines of each layout 
+        over the track (see `to_uv_track`)
+    """
+    K, J = layouts.shape[:2]
+    # propagate all the candidates' antennas as one array
+    track_xy = propagate_track(layouts.reshape(-1, 2), elapsed).reshape(-1, K, J, 2)
+    i, j = baseline_pairs(J).T
+    uv = (track_xy[:,:,i] - track_xy[:,:,j]) / wavelength
+    return uv.transpose(1, 0, 2, 3).reshape(K, -1, 2)
+
+def grid_psfs(uvs, imwidth, samples_per_dim, zero_spacing=0.0, kernel='kaiser-bessel', support=6, oversample=2):
+    """
+    Dirty beams of many uv coverages at once with gridding and a batched
+    FFT, like `dirty_beam` with the fft method and hermitian baselines.
+
+    Parameters
+    ----------
+    uvs : ndarray
+        K x V x 2 array of unique (u,v) baselines of each coverage
+
+    imwidth : float
+        beam image width in degrees
+
+    samples_per_dim : int
+        samples per dimension of each beam image
+
+    zero_spacing : float
+        number of autocorrelations to include in each beam
+
+    kernel, support, oversample :
+        gridding options (see `compute_dirty_image_fft`)
+
+    Returns
+    -------
+    psfs : ndarray
+        K x samples_per_dim x samples_per_dim real dirty beams 
+        normalized to their peak magnitude
+    """
+    K, V = uvs.shape[:2]
+    N = samples_per_dim
+    M, cellsize, shift = fft_grid_geometry(imwidth, N, oversample)
+    # grid each baseline and its conjugate so the beams come out real
+    uv = np.concatenate((uvs, -uvs), axis=1).reshape(-1, 2)
+    values = np.exp(-1j*2*np.pi*shift*uv.sum(axis=1))
+    idx, weights = kernel_taps(uv / cellsize, M, kernel, support, oversample)
+    # one bincount fills all K grids, each offset into its own M*M block
+    idx = idx + (np.arange(K)*M*M).repeat(2*V)[:,None,None]
+    values = values[:,None,None]*weights
+    grid = np.bincount(idx.reshape(-1), values.real.reshape(-1), minlength=K*M*M) + \
+        1j*np.bincount(idx.reshape(-1), values.imag.reshape(-1), minlength=K*M*M)
+    psfs = image_from_grid(grid.reshape(K, M, M), N, kernel, support, oversample).real + zero_spacing
+    return psfs / np.amax(np.abs(psfs), axis=(1, 2))[:,None,None]
+
+def psf_metrics(psfs, imwidth):
+    """
+    Parameters
+    ----------
+    psfs : ndarray
+        K x N x N dirty beams centered on pixel (N//2, N//2) 
+        (see `grid_psfs`)
+
+    imwidth : float
+        beam image width in degrees
+
+    Returns
+    -------
+    sidelobe : ndarray
+        K vector of the largest beam magnitude outside the main lobe 
+        (out to its first null along l and m), relative to the peak
+
+    beamwidth : ndarray
+        K vector of the main lobe full width at half maximum in degrees,
+        averaged over l and m
+    """
+    N = psfs.shape[1]
+    c = N//2
+    peak = psfs[:, c, c]
+    # profiles from the center outwards along l and m, K x 2 x (N - c)
+    profiles = np.stack((psfs[:, c, c:], psfs[:, c:, c]), axis=1) / peak[:,None,None]
+    below = profiles < 0.5
+    below[..., -1] = True
+    half = np.argmax(below, axis=2)
+    # the main lobe ends at the first null or local minimum
+    rising = np.diff(profiles, axis=2) > 0
+    ends = rising | (profiles[..., 1:] <= 0)
+    ends[..., -1] = True
+    null = np.argmax(ends, axis=2) + 1
+    patch = np.amax(null, axis=1)
+    offsets = np.abs(np.arange(N) - c)
+    distance = np.maximum.outer(offsets, offsets)
+    outside = np.where(distance[np.newaxis] > patch[:,None,None], np.abs(psfs), 0)
+    sidelobe = np.amax(outside, axis=(1, 2)) / np.abs(peak)
+    beamwidth = np.mean(half, axis=1)*2*imwidth / N
+    return sidelobe, beamwidth
+
+def uv_fill_fraction(uvs, imwidth, samples_per_dim, oversample=2):
+    """
+    Parameters
+    ----------
+    uvs : ndarray
+        K x V x 2 array of unique (u,v) baselines of each coverage
+
+    imwidth, samples_per_dim, oversample :
+        image geometry of the uv grid (see `fft_grid_geometry`)
+
+    Returns
+    -------
+    fill : ndarray
+        K vector of the fraction of uv cells inside the longest 
+        baseline that hold a baseline or its conjugate
+    """
+    K = uvs.shape[0]
+    M, cellsize, _ = fft_grid_geometry(imwidth, samples_per_dim, oversample)
+    cells = np.rint(np.concatenate((uvs, -uvs), axis=1) / cellsize).astype(int)
+    inside = np.all(np.abs(cells) < M//2, axis=2)
+    idx = (cells[...,1] % M)*M + cells[...,0] % M + (np.arange(K)*M*M)[:,None]
+    occupied = np.bincount(idx[inside], minlength=K*M*M).reshape(K, -1) > 0
+    radius = np.minimum(np.amax(np.hypot(cells[...,0], cells[...,1]), axis=1), M//2)
+    area = np.maximum(np.pi*radius**2, 1)
+    return np.minimum(np.count_nonzero(occupied, axis=1) / area, 1.0)
+
+def score_layouts(layouts, elapsed, wavelength, imwidth, samples_per_dim, batch=16, **kwargs):
+    """
+    Parameters
+    ----------
+    layouts : ndarray
+        K x J x 2 array of candidate antenna (x,y) positions
+
+    elapsed : ndarray
+        T vector of elapsed hours for each time step
+
+    wavelength : float
+        wavelength in meters
+
+    imwidth : float
+        beam image width in degrees
+
+    samples_per_dim : int
+        samples per dimension of the beam images
+
+    batch : int
+        number of candidates to grid and transform at once
+
+    kwargs :
+        gridding options (see `grid_psfs`)
+
+    Returns
+    -------
+    metrics : dict
+        K vectors of the "sidelobe" level, "beamwidth" and uv "fill" 
+        fraction of each layout (see `psf_metrics` and `uv_fill_fraction`)
+    """
+    K, J = layouts.shape[:2]
+    metrics = {'sidelobe': np.empty(K), 'beamwidth': np.empty(K), 'fill': np.empty(K)}
+    for start in range(0, K, batch):
+        uvs = layout_uv_tracks(layouts[start:start+batch], elapsed, wavelength)
+        psfs = grid_psfs(uvs, imwidth, samples_per_dim, len(elapsed)*J, **kwargs)
+        sidelobe, beamwidth = psf_metrics(psfs, imwidth)
+        metrics['sidelobe'][start:start+batch] = sidelobe
+        metrics['beamwidth'][start:start+batch] = beamwidth
+        metrics['fill'][start:start+batch] = uv_fill_fraction(uvs, imwidth, samples_per_dim, kwargs.get('oversample', 2))
+    return metrics
+
+def fft_convolve(a, b, mode='full'):
+    """
+    Parameters
+    ----------
+    a : ndarray
+        2D real array
+
+    b : ndarray
+        2D real array
+
+    mode : str
+        "full" for the full convolution or "same" for the center 
+        matching the shape of `a` (as in `scipy.signal.convolve2d`)
+
+    Returns
+    -------
+    convolved : ndarray
+        2D convolution of `a` and `b` computed by FFT
+    """
+    shape = (a.shape[0] + b.shape[0] - 1, a.shape[1] + b.shape[1] - 1)
+    full = np.fft.irfft2(np.fft.rfft2(a, shape)*np.fft.rfft2(b, shape), shape)
+    if mode == 'full':
+        return full
+    r0 = (shape[0] - a.shape[0]) // 2
+    c0 = (shape[1] - a.shape[1]) // 2
+    return full[r0:r0+a.shape[0], c0:c0+a.shape[1]]
+
+def restore(point_sources_map, beamwidth, synthetic_bw):
+    """
+    Parameters
+    ----------
+    point_sources_map : ndarray
+        NxN map of CLEAN components
+
+    beamwidth : float
+        beamwidth in degrees
+
+    synthetic_bw : float
+        estimated beamwidth of synthetic aperture
+
+    Returns
+    -------
+    restored_image : ndarray
+        NxN components convolved with a Gaussian synthetic beam
+    """
+    N = point_sources_map.shape[0]
+    X,Y = np.meshgrid(np.arange(0,N)/N-0.5, np.arange(0,N)/N-0.5)
+    gaussian_beam = np.exp(-(X**2 + Y**2)/(2*((synthetic_bw/beamwidth)**2)))
+    return fft_convolve(point_sources_map, gaussian_beam, mode='same')
 
-def clean(image, uvs, beamwidth, synthetic_bw, iters=100, lmbda=0.1):
+@PROFILER.timed('clean')
+def clean(image, uvs, beamwidth, synthetic_bw, iters=100, lmbda=0.1, method='dft', psf=None, threshold=None, tol=None, psf_cutoff=0.0, **kwargs):
     """
     Parameters
     ----------
@@ -509,38 +3095,293 @@ def clean(image, uvs, beamwidth, synthetic_bw, iters=100, lmbda=0.1):
         estimated beamwidth of synthetic aperture
 
     iters : int
-        number of CLEAN iterations
+        maximum number of CLEAN iterations
 
     lmbda : float
         weighting parameter (CLEANing "rate")
 
+    method : str
+        imaging method for the dirty beam (see `compute_dirty_image`)
+
+    psf : ndarray | None
+        precomputed 2N x 2N dirty beam (as from `dirty_beam` with twice 
+        the beamwidth and size), or None to compute it from `uvs`
+
+    threshold : float | None
+        stop once the residual peak falls below this fraction 
+        of the dirty image peak
+
+    tol : float | None
+        stop once the residual peak changes by less than this
+        fraction between iterations
+
+    psf_cutoff : float
+        treat dirty beam values below this fraction of its peak as zero,
+        so each iteration only touches the beam's support
+
     Returns
     -------
     cleaned_image : ndarray
         NxN CLEANed image
     """
     N = image.shape[0]
-    dirty = dirty_beam(uvs, beamwidth*2, image.shape[0]*2)
-    image = np.abs(image)
-    image /= np.amax(image)
-
-    padded_image = np.zeros((N*3,N*3))
-    padded_image[int(N):int(2*N), int(N):int(2*N)] = np.abs(image)
+    if psf is None:
+        psf = dirty_beam(uvs, beamwidth*2, N*2, method, **kwargs)
+    if psf_cutoff:
+        psf = np.where(np.abs(psf) >= psf_cutoff*np.amax(np.abs(psf)), psf, 0)
+    support_rows = np.flatnonzero(np.any(psf != 0, axis=1))
+    support_cols = np.flatnonzero(np.any(psf != 0, axis=0))
+    residual = np.abs(image)
+    residual /= np.amax(residual)
     point_sources_map = np.zeros((N,N))
 
+    last_peak = None
     for _ in range(iters):
-        image = padded_image[int(N):int(2*N), int(N):int(2*N)]
-        flattened_idx = np.argmax(np.abs(image))
-        maxval = image.reshape(-1)[flattened_idx]
-        row = int(flattened_idx / N)
-        col = flattened_idx % N
+        row, col = np.unravel_index(np.argmax(np.abs(residual)), residual.shape)
+        peak = abs(residual[row, col])
+        if threshold is not None and peak < threshold:
+            break
+        if tol is not None and last_peak is not None and abs(last_peak - peak) <= tol*last_peak:
+            break
+        last_peak = peak
+        maxval = residual[row, col]
         point_sources_map[row, col] += lmbda*maxval
-        padded_image[int(row):int(row+2*N), int(col):int(col+2*N)] -= lmbda*maxval*dirty
 
-    residuals = padded_image[int(N):int(2*N), int(N):int(2*N)]
-    X,Y = np.meshgrid(np.arange(0,N)/N-0.5, np.arange(0,N)/N-0.5)
-    gaussian_beam = np.exp(-(X**2 + Y**2)/(2*((synthetic_bw/beamwidth)**2)))
-    im = convolve2d(point_sources_map, gaussian_beam, mode='same')
+        # the beam is centered on pixel (N, N), so image pixel i sees psf[N - row + i]
+        r0, r1 = max(0, support_rows[0] - N + row), min(N, support_rows[-1] + 1 - N + row)
+        c0, c1 = max(0, support_cols[0] - N + col), min(N, support_cols[-1] + 1 - N + col)
+        if r0 >= r1 or c0 >= c1:
+            continue
+        residual[r0:r1, c0:c1] -= lmbda*maxval*psf[N-row+r0:N-row+r1, N-col+c0:N-col+c1]
 
+    im = restore(point_sources_map, beamwidth, synthetic_bw)
     return np.abs(im)
 
+DECONVOLVERS = ('hogbom', 'clark', 'cotton-schwab')
+
+def clark_minor_cycle(residual, psf, lmbda=0.1, iters=100, stop_level=0.0, patch=None):
+    """
+    Clark minor cycle: Hogbom CLEAN against a beam patch, restricted to 
+    the pixels brighter than `stop_level` at the start of the cycle.
+
+    Parameters
+    ----------
+    residual : ndarray
+        NxN residual image
+
+    psf : ndarray
+        2N x 2N dirty beam centered on pixel (N, N)
+
+    lmbda : float
+        weighting parameter (CLEANing "rate")
+
+    iters : int
+        maximum number of components to find
+
+    stop_level : float
+        stop once the peak of the active pixels falls below this level
+
+    patch : int | None
+        half width of the beam patch in pixels (default N/4)
+
+    Returns
+    -------
+    components : ndarray
+        NxN map of the CLEAN components found
+
+    found : int
+        number of iterations run
+    """
+    N = residual.shape[0]
+    patch = patch if patch else N // 4
+    rows, cols = np.nonzero(np.abs(residual) >= stop_level)
+    values = residual[rows, cols].copy()
+    components = np.zeros((N, N))
+    found = 0
+    while found < iters and values.shape[0] > 0:
+        k = np.argmax(np.abs(values))
+        peak = values[k]
+        if np.abs(peak) < stop_level:
+            break
+        row, col = rows[k], cols[k]
+        components[row, col] += lmbda*peak
+        dr, dc = rows - row, cols - col
+        near = (np.abs(dr) <= patch) & (np.abs(dc) <= patch)
+        values[near] -= lmbda*peak*psf[N + dr[near], N + dc[near]]
+        found += 1
+    return components, found
+
+def exterior_sidelobe(psf, patch):
+    """
+    Parameters
+    ----------
+    psf : ndarray
+        2N x 2N dirty beam centered on pixel (N, N)
+
+    patch : int
+        half width of the beam patch in pixels
+
+    Returns
+    -------
+    sidelobe : float
+        largest beam magnitude outside the patch, relative to the peak
+    """
+    N = psf.shape[0] // 2
+    outside = np.abs(psf).copy()
+    outside[N-patch:N+patch+1, N-patch:N+patch+1] = 0
+    return np.amax(outside) / np.abs(psf[N, N])
+
+@PROFILER.timed('clean')
+def clark_clean(image, psf, lmbda=0.1, iters=1000, threshold=None, patch=None, cycles=10):
+    """
+    Clark CLEAN: minor cycles against a beam patch, with major cycles 
+    that subtract the components convolved with the full beam (by FFT).
+
+    Parameters
+    ----------
+    image : ndarray
+        NxN dirty image
+
+    psf : ndarray
+        2N x 2N dirty beam centered on pixel (N, N)
+
+    lmbda : float
+        weighting parameter (CLEANing "rate")
+
+    iters : int
+        maximum total number of components
+
+    threshold : float | None
+        stop once the residual peak falls below this fraction 
+        of the dirty image peak
+
+    patch : int | None
+        half width of the beam patch in pixels (default N/4)
+
+    cycles : int
+        maximum number of major cycles
+
+    Returns
+    -------
+    point_sources_map : ndarray
+        NxN map of CLEAN components
+
+    residual : ndarray
+        NxN residual image
+    """
+    N = image.shape[0]
+    patch = patch if patch else N // 4
+    dirty = np.abs(image)
+    dirty /= np.amax(dirty)
+    sidelobe = exterior_sidelobe(psf, patch)
+    floor = threshold if threshold else 0.0
+    point_sources_map = np.zeros((N, N))
+    residual = dirty
+    remaining = iters
+    for _ in range(cycles):
+        peak = np.amax(np.abs(residual))
+        if remaining <= 0 or peak <= floor:
+            break
+        components, found = clark_minor_cycle(
+            residual, 
+            psf, 
+            lmbda, 
+            remaining, 
+            max(floor, sidelobe*peak), 
+            patch
+        )
+        if found == 0:
+            break
+        remaining -= found
+        point_sources_map += components
+        residual = dirty - fft_convolve(point_sources_map, psf, mode='full')[N:2*N, N:2*N]
+    return point_sources_map, residual
+
+@PROFILER.timed('clean')
+def cotton_schwab_clean(uv, xcorr, imwidth, samples_per_dim, lmbda=0.1, iters=1000, threshold=None, patch=None, cycles=10, method='fft', hermitian=False, weights=None, **kwargs):
+    """
+    Cotton-Schwab CLEAN: Clark minor cycles, with major cycles that 
+    subtract the component model from the visibilities and re-image.
+
+    Parameters
+    ----------
+    uv : ndarray
+        V x 2 matrix of (u,v) baselines
+
+    xcorr : ndarray
+        V vector of cross correlations
+
+    imwidth : float
+        image beamwidth in degrees
+
+    samples_per_dim : int
+        samples per dimension of the image
+
+    lmbda : float
+        weighting parameter (CLEANing "rate")
+
+    iters : int
+        maximum total number of components
+
+    threshold : float | None
+        stop once the residual peak falls below this fraction 
+        of the dirty image peak
+
+    patch : int | None
+        half width of the beam patch in pixels (default N/4)
+
+    cycles : int
+        maximum number of major cycles
+
+    method : str
+        imaging method for the major cycles (see `compute_dirty_image`)
+
+    hermitian : bool
+        `uv` and `xcorr` are unique baselines (see `compute_dirty_image`);
+        the autocorrelations are left out
+
+    weights : ndarray | None
+        V vector of visibility weights (see `compute_dirty_image`)
+
+    kwargs :
+        extra options for the imaging backend
+
+    Returns
+    -------
+    point_sources_map : ndarray
+        NxN map of CLEAN components
+
+    residual : ndarray
+        NxN residual image
+    """
+    N = samples_per_dim
+    patch = patch if patch else N // 4
+    xcorr = np.asarray(xcorr).reshape(-1)
+    sampling = np.ones(uv.shape[0]) if weights is None else np.asarray(weights, dtype=float)
+    weight = np.sum(sampling)*(2 if hermitian else 1)
+    psf = _dirty_image(uv, sampling, imwidth*2, N*2, method, hermitian, **kwargs).real / weight
+    sidelobe = exterior_sidelobe(psf, patch)
+    residual = _dirty_image(uv, xcorr, imwidth, N, method, hermitian, 0.0, weights, **kwargs).real / weight
+    floor = (threshold if threshold else 0.0)*np.amax(np.abs(residual))
+    point_sources_map = np.zeros((N, N))
+    remaining = iters
+    for _ in range(cycles):
+        peak = np.amax(np.abs(residual))
+        if remaining <= 0 or peak <= floor:
+            break
+        components, found = clark_minor_cycle(
+            residual, 
+            psf, 
+            lmbda, 
+            remaining, 
+            max(floor, sidelobe*peak), 
+            patch
+        )
+        if found == 0:
+            break
+        remaining -= found
+        point_sources_map += components
+        predict_opts = {k: v for k, v in kwargs.items() if k in ('kernel', 'support', 'oversample')}
+        model_xcorr = predict_visibilities(point_sources_map, uv, imwidth, method, **predict_opts)
+        residual = _dirty_image(uv, xcorr - model_xcorr, imwidth, N, method, hermitian, 0.0, weights, **kwargs).real / weight
+    return point_sources_map, residual
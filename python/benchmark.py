@@ -0,0 +1,375 @@
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+EXAMPLE_OBSERVATION = {
+    'target': {'ra': 83.6, 'dec': 22.0},
+    'antennas': [
+        {'x': 0, 'y': 0, 'size': 3, 'eta': 0.5},
+        {'x': 10, 'y': 5, 'size': 3, 'eta': 0.5},
+        {'x': -8, 'y': 12, 'size': 3, 'eta': 0.5},
+        {'x': 20, 'y': -15, 'size': 3, 'eta': 0.5},
+    ],
+    'timestamp': '2020-05-01T03:00:00',
+    'duration': 0.1,
+    'latitude': 38.0,
+    'longitude': -84.5,
+    'wavelength': 0.21,
+    'samplingRate': 1e6,
+    'bandwidth': 1e6,
+}
+
+def time_command(command, repeat=5):
+    """
+    Parameters
+    ----------
+    command : list
+        command line to run
+
+    repeat : int
+        number of runs
+
+    Returns
+    -------
+    seconds : list
+        wall clock time of each run
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=HERE, check=True, stdout=subprocess.DEVNULL)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+def time_callable(fn, repeat=5):
+    """
+    Parameters
+    ----------
+    fn : callable
+        called with no arguments
+
+    repeat : int
+        number of runs
+
+    Returns
+    -------
+    seconds : list
+        wall clock time of each run
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+def bench_startup(repeat=5):
+    """
+    Time process startup for the CLI and library.
+
+    Parameters
+    ----------
+    repeat : int
+        number of runs of each command
+
+    Returns
+    -------
+    records : list
+        one result dict per command
+    """
+    observation = json.dumps(EXAMPLE_OBSERVATION)
+    commands = {
+        'import_astrofluxlib': [sys.executable, '-c', 'import astrofluxlib'],
+        'cli_help': [sys.executable, 'astroflux.py', '-h'],
+        'cli_cross_dump': [
+            sys.executable, 'astroflux.py', '--sky=cross', '--json', observation,
+            '--fast', '--imager=fft', '--dump'
+        ],
+        'cli_cross_npz': [
+            sys.executable, 'astroflux.py', '--sky=cross', '--json', observation,
+            '--fast', '--imager=fft', '--dump', '--output-format=npz', 
+            '--outdir', tempfile.gettempdir()
+        ],
+    }
+    records = []
+    for name, command in commands.items():
+        seconds = time_command(command, repeat)
+        records.append({
+            'suite': 'startup',
+            'name': name,
+            'median_s': float(np.median(seconds)),
+            'min_s': float(np.min(seconds)),
+            'runs': len(seconds),
+        })
+    return records
+
+def peak_memory(fn):
+    """
+    Parameters
+    ----------
+    fn : callable
+        called once with no arguments
+
+    Returns
+    -------
+    peak_bytes : int
+        peak memory traced while `fn` ran (numpy arrays included)
+    """
+    # restart tracing rather than resetting the peak, which needs Python 3.9
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+def write_synthetic_fits(path, shape=(360, 720)):
+    """
+    Write an all-sky plate carree map with smooth structure, laid out
+    like the survey maps `FITSSkyMap` reads (image in the first extension).
+
+    Parameters
+    ----------
+    path : str
+        output FITS path
+
+    shape : tuple
+        (rows, columns) of the image
+    """
+    from astropy.io import fits
+    from astropy.wcs import WCS
+    ny, nx = shape
+    w = WCS(naxis=2)
+    w.wcs.ctype = ['GLON-CAR', 'GLAT-CAR']
+    w.wcs.crpix = [(nx + 1) / 2, (ny + 1) / 2]
+    w.wcs.cdelt = [-360 / nx, 180 / ny]
+    w.wcs.crval = [0, 0]
+    y, x = np.mgrid[0:ny, 0:nx]
+    data = (np.sin(x / 37.0)*np.cos(y / 23.0)*100 + 200).astype(np.float32)
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(data, header=w.to_header())]).writeto(path, overwrite=True)
+
+WAVELENGTH = 0.21
+
+def hotpath_inputs(J=4, N=32, T=1, fits_path=None):
+    """
+    Parameters
+    ----------
+    J : int
+        number of antennas
+
+    N : int
+        samples_per_dim of the sky and images
+
+    T : int
+        number of time steps
+
+    fits_path : str | None
+        synthetic FITS sky map (see `write_synthetic_fits`)
+
+    Returns
+    -------
+    inputs : dict
+        deterministic arrays and objects for the hot path benchmarks
+    """
+    import astrofluxlib as aflux
+    rng = np.random.default_rng(0)
+    o = EXAMPLE_OBSERVATION
+    observation = aflux.Observation(o['target']['ra'], o['target']['dec'], o['latitude'], o['longitude'], o['timestamp'], T*0.1)
+    antenna_xy = rng.uniform(-50, 50, (J, 2))
+    beamwidth = aflux.parabolic_beamwidth(3, WAVELENGTH, degrees=True)
+    skymap = aflux.StarSky(N, rng)
+    elapsed = np.arange(T)*0.1
+    lm = aflux.create_antenna_beam_lm_samples(beamwidth, N)
+    pixeldata = skymap.get_temp_mk(None)
+    signals = aflux.generate_antenna_signals(antenna_xy, lm, pixeldata, WAVELENGTH)
+    uv, xcorr, track_signals, _ = aflux.simulate_track(observation, antenna_xy, beamwidth, WAVELENGTH, skymap, elapsed, N, unique=True)
+    uv, xcorr = uv.reshape(-1, 2), xcorr.reshape(-1)
+    imaging = {'hermitian': True, 'zero_spacing': aflux.autocorrelation_sum(track_signals)}
+    image = aflux.compute_dirty_image(uv, xcorr, beamwidth, N, 'fft', **imaging)
+    psf = aflux.dirty_beam(uv, beamwidth*2, N*2, 'fft', hermitian=True, zero_spacing=T*J, cache=None)
+    ra_dec = np.stack((rng.uniform(0, 360, N*N), rng.uniform(-90, 90, N*N)), axis=1)
+    return {
+        'aflux': aflux, 'observation': observation, 'antenna_xy': antenna_xy, 'beamwidth': beamwidth, 
+        'skymap': skymap, 'elapsed': elapsed, 'lm': lm, 'pixeldata': pixeldata, 'signals': signals, 
+        'uv': uv, 'xcorr': xcorr, 'imaging': imaging, 'image': image, 'psf': psf, 'ra_dec': ra_dec,
+        'fits_path': fits_path, 'N': N, 'T': T, 'J': J,
+    }
+
+def _simulate_steps(x):
+    aflux = x['aflux']
+    for t in x['elapsed']:
+        axy = aflux.propagate_antennas(x['antenna_xy'], t)
+        aflux.simulate(x['observation'], axy, x['beamwidth'], WAVELENGTH, x['skymap'], x['N'])
+
+def _fits_sampler(x):
+    skymap = x['aflux'].FITSSkyMap(x['fits_path'])
+    return lambda: skymap.get_temp_mk(x['ra_dec'])
+
+# (name, matrix dimensions it depends on, inputs -> callable to time)
+HOT_PATHS = [
+    ('to_uv', ('J',), lambda x: lambda: x['aflux'].to_uv(x['antenna_xy'], WAVELENGTH)),
+    ('xcorr_signals', ('J',), lambda x: lambda: x['aflux'].xcorr_signals(x['signals'])),
+    ('generate_antenna_signals', ('J', 'N'), lambda x: lambda: x['aflux'].generate_antenna_signals(x['antenna_xy'], x['lm'], x['pixeldata'], WAVELENGTH)),
+    ('simulate', ('J', 'N', 'T'), lambda x: lambda: _simulate_steps(x)),
+    ('simulate_track', ('J', 'N', 'T'), lambda x: lambda: x['aflux'].simulate_track(x['observation'], x['antenna_xy'], x['beamwidth'], WAVELENGTH, x['skymap'], x['elapsed'], x['N'], unique=True)),
+    ('compute_dirty_image[dft]', ('J', 'N', 'T'), lambda x: lambda: x['aflux'].compute_dirty_image(x['uv'], x['xcorr'], x['beamwidth'], x['N'], 'dft', **x['imaging'])),
+    ('compute_dirty_image[fft]', ('J', 'N', 'T'), lambda x: lambda: x['aflux'].compute_dirty_image(x['uv'], x['xcorr'], x['beamwidth'], x['N'], 'fft', **x['imaging'])),
+    ('dirty_beam[dft]', ('J', 'N', 'T'), lambda x: lambda: x['aflux'].dirty_beam(x['uv'], x['beamwidth']*2, x['N']*2, 'dft', hermitian=True, zero_spacing=x['T']*x['J'], cache=None)),
+    ('clean', ('J', 'N', 'T'), lambda x: lambda: x['aflux'].clean(x['image'], x['uv'], x['beamwidth'], x['beamwidth'] / 4, 1000, 0.05, psf=x['psf'])),
+    ('FITSSkyMap.get_temp_mk', ('N',), _fits_sampler),
+]
+
+def bench_hotpaths(repeat=5, antennas=(4, 16), sizes=(32, 64), steps=(1, 10)):
+    """
+    Time and measure the peak memory of the library hot paths across a 
+    scaling matrix of antennas J, samples_per_dim N and time steps T.
+
+    Parameters
+    ----------
+    repeat : int
+        number of timed runs of each hot path
+
+    antennas, sizes, steps : sequence
+        values of J, N and T; each hot path runs for every combination
+        of the dimensions it depends on
+
+    Returns
+    -------
+    records : list
+        one result dict per hot path and matrix point
+    """
+    matrix = {'J': tuple(antennas), 'N': tuple(sizes), 'T': tuple(steps)}
+    records = []
+    with tempfile.TemporaryDirectory() as tmp:
+        fits_path = os.path.join(tmp, 'sky.fits')
+        try:
+            write_synthetic_fits(fits_path)
+        except ImportError:
+            fits_path = None
+        inputs = {}
+        for name, dims, setup in HOT_PATHS:
+            if name.startswith('FITSSkyMap') and fits_path is None:
+                continue
+            for values in itertools.product(*(matrix[d] for d in dims)):
+                params = dict(zip(dims, values))
+                point = tuple(params.get(d, matrix[d][0]) for d in ('J', 'N', 'T'))
+                if point not in inputs:
+                    inputs[point] = hotpath_inputs(*point, fits_path=fits_path)
+                fn = setup(inputs[point])
+                # one untimed run so caches and lazy imports are warm
+                fn()
+                seconds = time_callable(fn, repeat)
+                records.append({
+                    'suite': 'hotpaths',
+                    'name': name,
+                    'params': params,
+                    'median_s': float(np.median(seconds)),
+                    'min_s': float(np.min(seconds)),
+                    'runs': len(seconds),
+                    'peak_bytes': peak_memory(fn),
+                })
+    return records
+
+SUITES = {
+    'startup': bench_startup,
+    'hotpaths': bench_hotpaths,
+}
+
+def record_key(record):
+    """
+    Parameters
+    ----------
+    record : dict
+        benchmark result
+
+    Returns
+    -------
+    key : tuple
+        identifies the measurement across result files
+    """
+    return (record['suite'], record['name'], tuple(sorted(record.get('params', {}).items())))
+
+def record_label(record):
+    """ Name of a record with its matrix parameters, for printing. """
+    params = ' '.join('{}={}'.format(k, v) for k, v in sorted(record.get('params', {}).items()))
+    return '{} {}'.format(record['name'], params).strip()
+
+def compare_records(baseline, records):
+    """
+    Parameters
+    ----------
+    baseline : list
+        records from an earlier run (e.g. another commit)
+
+    records : list
+        records from this run
+
+    Returns
+    -------
+    rows : list
+        (record, baseline record) pairs of the measurements in both
+    """
+    previous = {record_key(record): record for record in baseline}
+    return [(record, previous[record_key(record)]) for record in records if record_key(record) in previous]
+
+def parse_ints(text):
+    return [int(value) for value in text.split(',')]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for the astroflux simulator')
+    parser.add_argument('suites', nargs='*', help='suites to run: {} (default all)'.format(', '.join(sorted(SUITES))))
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement')
+    parser.add_argument('--output', type=str, help='write the JSON results to this path')
+    parser.add_argument('--compare', type=str, help='JSON results of an earlier run to compare against')
+    parser.add_argument('--antennas', type=parse_ints, default=[4, 16], help='hotpaths values of J, e.g. 4,16,64')
+    parser.add_argument('--sizes', type=parse_ints, default=[32, 64], help='hotpaths values of samples_per_dim N')
+    parser.add_argument('--steps', type=parse_ints, default=[1, 10], help='hotpaths values of time steps T')
+    args = parser.parse_args()
+    for suite in args.suites:
+        if suite not in SUITES:
+            parser.error('unknown suite "{}"'.format(suite))
+
+    records = []
+    for suite in (args.suites or sorted(SUITES)):
+        options = {'repeat': args.repeat}
+        if suite == 'hotpaths':
+            options.update(antennas=args.antennas, sizes=args.sizes, steps=args.steps)
+        records.extend(SUITES[suite](**options))
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for record, previous in compare_records(baseline, records):
+            memory = ''
+            if record.get('peak_bytes') and previous.get('peak_bytes'):
+                memory = ' memory {:6.2f}x'.format(record['peak_bytes'] / previous['peak_bytes'])
+            print('{:>10} {:<44} {:10.3f} ms  was {:10.3f} ms {:6.2f}x{}'.format(
+                record['suite'], 
+                record_label(record), 
+                record['median_s']*1e3, 
+                previous['median_s']*1e3, 
+                record['median_s'] / previous['median_s'],
+                memory
+            ))
+    else:
+        for record in records:
+            memory = ' {:9.1f} MB'.format(record['peak_bytes'] / 2**20) if 'peak_bytes' in record else ''
+            print('{:>10} {:<44} {:10.3f} ms{}'.format(record['suite'], record_label(record), record['median_s']*1e3, memory))
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(records, indent=2))
+
+if __name__ == '__main__':
+    main()
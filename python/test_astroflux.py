@@ -0,0 +1,140 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+import astrofluxlib as aflux
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+OBSERVATION = {
+    'target': {'ra': 83.6, 'dec': 22.0},
+    'antennas': [
+        {'x': 0, 'y': 0, 'size': 3, 'eta': 0.5},
+        {'x': 10, 'y': 5, 'size': 3, 'eta': 0.5},
+        {'x': -8, 'y': 12, 'size': 3, 'eta': 0.5},
+    ],
+    'timestamp': '2020-05-01T03:00:00',
+    'duration': 0.5,
+    'longitude': -84.5,
+    'latitude': 38.0,
+    'wavelength': 0.21,
+    'samplingRate': 1e6,
+    'bandwidth': 1e6,
+}
+
+def run_cli(*args):
+    """
+    Parameters
+    ----------
+    args : str
+        command line options for `astroflux.py`
+
+    Returns
+    -------
+    process : subprocess.CompletedProcess
+        the finished run with its captured output
+    """
+    return subprocess.run(
+        [sys.executable, os.path.join(HERE, 'astroflux.py')] + list(args),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, cwd=HERE)
+
+class ProfileTest(unittest.TestCase):
+    def test_profile_without_stream(self):
+        with tempfile.TemporaryDirectory() as outdir:
+            path = os.path.join(outdir, 'profile.json')
+            process = run_cli(
+                '--sky=cross', '--json', json.dumps(OBSERVATION), '--fast', '--dump',
+                '--outdir', outdir, '--profile', path)
+            self.assertEqual(process.returncode, 0, process.stderr)
+            with open(path) as f:
+                report = json.load(f)
+        for stage in ('simulate', 'phase_matrix', 'correlate', 'imaging', 'dirty_beam', 'clean'):
+            self.assertIn(stage, report['stages'])
+            self.assertGreater(report['stages'][stage]['calls'], 0)
+
+def simulate(**kwargs):
+    """
+    Parameters
+    ----------
+    kwargs :
+        extra options for `astrofluxlib.simulate_track`
+
+    Returns
+    -------
+    results : tuple
+        track baselines, cross correlations, signals and sky pixels of a
+        short noisy cross sky observation with `OBSERVATION`'s antennas
+    """
+    observation = aflux.Observation(
+        OBSERVATION['target']['ra'],
+        OBSERVATION['target']['dec'],
+        OBSERVATION['latitude'],
+        OBSERVATION['longitude'],
+        OBSERVATION['timestamp'],
+        OBSERVATION['duration'])
+    antenna_xy = np.array([[a['x'], a['y']] for a in OBSERVATION['antennas']], dtype=float)
+    beamwidth = aflux.parabolic_beamwidth(3.0, OBSERVATION['wavelength'], degrees=True)
+    elapsed = np.arange(0, OBSERVATION['duration'], 0.1)
+    kwargs.setdefault('seed', 5)
+    return aflux.simulate_track(
+        observation, antenna_xy, beamwidth, OBSERVATION['wavelength'], aflux.CrossSky(), elapsed,
+        samples_per_dim=32, snr=10, **kwargs)
+
+class ImagingTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.beamwidth = aflux.parabolic_beamwidth(3.0, OBSERVATION['wavelength'], degrees=True)
+        # unique baselines, as the CLI images them
+        cls.uv, cls.xcorr, cls.signals, _ = simulate(unique=True)
+        cls.uv = cls.uv.reshape(-1, 2)
+        cls.xcorr = cls.xcorr.reshape(-1)
+
+    def assertImagesClose(self, image, reference, rtol):
+        error = np.amax(np.abs(image - reference)) / np.amax(np.abs(reference))
+        self.assertLess(error, rtol)
+
+    def test_chunked_dft_matches_direct(self):
+        direct = aflux.compute_dirty_image(self.uv, self.xcorr, self.beamwidth, 32)
+        chunked = aflux.compute_dirty_image(self.uv, self.xcorr, self.beamwidth, 32, max_mem='64K')
+        self.assertImagesClose(chunked, direct, 1e-12)
+
+    def test_parallel_track_matches_serial(self):
+        serial = simulate(workers=1)
+        parallel = simulate(workers=3)
+        for a, b in zip(parallel, serial):
+            np.testing.assert_array_equal(a, b)
+
+    def test_hermitian_image_matches_all_baselines(self):
+        uv, xcorr, _, _ = simulate(unique=False)
+        full = aflux.compute_dirty_image(uv.reshape(-1, 2), xcorr.reshape(-1), self.beamwidth, 32)
+        hermitian = aflux.compute_dirty_image(
+            self.uv, self.xcorr, self.beamwidth, 32,
+            hermitian=True, zero_spacing=aflux.autocorrelation_sum(self.signals))
+        self.assertImagesClose(hermitian, full.real, 1e-12)
+
+    def test_fft_imager_matches_dft(self):
+        errors = aflux.check_imager(self.uv, self.xcorr, self.beamwidth, 32, 'fft', hermitian=True)
+        self.assertLess(errors['max_rel'], 1e-4)
+
+    def test_merged_baselines_image_like_originals(self):
+        # a regular line of antennas has exactly redundant baselines, and
+        # flipping some to their conjugates leaves the hermitian image unchanged
+        rng = np.random.default_rng(0)
+        uv = aflux.to_uv(np.arange(6)[:,np.newaxis]*np.array([[10.0, 4.0]]), OBSERVATION['wavelength'], unique=True)
+        xcorr = rng.normal(size=uv.shape[0]) + 1j*rng.normal(size=uv.shape[0])
+        flip = rng.random(uv.shape[0]) < 0.5
+        uv = np.where(flip[:,np.newaxis], -uv, uv)
+        xcorr = np.where(flip, xcorr.conj(), xcorr)
+        merged_uv, merged_xcorr, weights = aflux.average_redundant_baselines(uv, xcorr, 0.01, hermitian=True)
+        self.assertLess(merged_uv.shape[0], uv.shape[0])
+        original = aflux.compute_dirty_image(uv, xcorr, self.beamwidth, 32, hermitian=True)
+        merged = aflux.compute_dirty_image(merged_uv, merged_xcorr, self.beamwidth, 32, hermitian=True, weights=weights)
+        self.assertImagesClose(merged, original, 1e-12)
+
+if __name__ == '__main__':
+    unittest.main()
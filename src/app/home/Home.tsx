@@ -15,6 +15,8 @@ import Observation from "../../model/Observation";
 import { remote as electron } from "electron";
 import ResultModal from "./ResultModal/ResultModal";
 import ObservationResult from "../../model/ObservationResult";
+import StreamImage from "../../model/StreamImage";
+import StreamImageView from "./StreamImageView";
 
 class Home extends React.Component<any, any> implements IHomeView {
     presenter: HomePresenter;
@@ -31,6 +33,8 @@ class Home extends React.Component<any, any> implements IHomeView {
             focusedAntennaBounds: undefined,
             animating: false,
             observeDisabled: false,
+            progress: undefined,
+            streamImage: undefined,
             resultModalData: undefined
         };
         this.updateWindowDims = this.updateWindowDims.bind(this);
@@ -53,6 +57,12 @@ class Home extends React.Component<any, any> implements IHomeView {
     ) {
         this.setState({ focusedAntenna, focusedAntennaBounds });
     }
+    showProgress(progress?: string) {
+        this.setState({ progress })
+    }
+    showStreamImage(streamImage?: StreamImage) {
+        this.setState({ streamImage })
+    }
     showResult(result: ObservationResult) {
         this.setState({ resultModalData: result })
     }
@@ -171,7 +181,7 @@ class Home extends React.Component<any, any> implements IHomeView {
                         }
                     </select>
                     <button onClick={() => this.presenter.observeClicked()} disabled={this.state.observedDisabled}>
-                        <FontAwesomeIcon icon={faSatelliteDish} /> {' Observe'}
+                        <FontAwesomeIcon icon={faSatelliteDish} /> {this.state.progress ? ` Cancel (${this.state.progress})` : ' Observe'}
                     </button>
                     <button onClick={() => this.presenter.addAntennaClicked()}>
                         <FontAwesomeIcon icon={faPlus} /> {' Antenna'}
@@ -193,6 +203,11 @@ class Home extends React.Component<any, any> implements IHomeView {
                         }
                     />
                 ) : undefined}
+                {
+                    (this.state.streamImage) ? <StreamImageView
+                        image={this.state.streamImage}
+                        size={Math.min(this.state.width, this.state.height) * 0.3}/> : undefined
+                }
                 {
                     (this.state.resultModalData) ? <ResultModal 
                         result={this.state.resultModalData}
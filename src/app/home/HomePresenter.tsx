@@ -1,11 +1,13 @@
 import AntennaModel from "../../model/AntennaModel";
 import { AntennaBounds } from "./AntennaVisual";
-import ObservationRunner from "../../domain/ObservationRunner";
+import ObservationRunner, { ObservationEvent } from "../../domain/ObservationRunner";
 import Observation from "../../model/Observation";
 import ObservationFileUtil from "../../domain/ObservationFileUtil";
 import { remote } from 'electron'
 import { join } from 'path'
 import ObservationResult from "../../model/ObservationResult";
+import StreamImage from "../../model/StreamImage";
+import NpyFileUtil from "../../domain/NpyFileUtil";
 
 
 export interface ObsFormData {
@@ -29,6 +31,8 @@ export interface IHomeView {
     showFormData(formData: ObsFormData): void
     setObserveButtonDisabled(disabled: boolean): void
     showResult(result: ObservationResult): void
+    showProgress(progress?: string): void
+    showStreamImage(image?: StreamImage): void
     dismissResult(): void
 }
 
@@ -53,6 +57,8 @@ export class HomePresenter {
     view: IHomeView
     data: Observation
     formData: ObsFormData
+    runner?: ObservationRunner
+    streamImageRequest = 0
     constructor(view: IHomeView) {
         this.view = view
         this.data = {
@@ -157,18 +163,51 @@ export class HomePresenter {
     }
 
     observeClicked() {
+        if (this.runner) {
+            this.runner.cancel()
+            return
+        }
         this.view.setAnimating(true)
-        this.view.setObserveButtonDisabled(true)
+        this.view.showProgress('Starting')
         const runner = new ObservationRunner(this.data)
-        runner.run(this.formData.sky)
+        this.runner = runner
+        runner.run(this.formData.sky, (event: ObservationEvent) => this.observationProgressed(event))
         .then(result => {
             this.view.showResult(result as ObservationResult)
-        }).finally(() => {
+        })
+        .catch((reason) => console.log(reason))
+        .finally(() => {
+            this.runner = undefined
+            this.streamImageRequest++
             this.view.setAnimating(false)
-            this.view.setObserveButtonDisabled(false)
+            this.view.showProgress(undefined)
+            this.view.showStreamImage(undefined)
         })
     }
 
+    observationProgressed(event: ObservationEvent) {
+        if (event.event === 'step') {
+            this.view.showProgress(`Step ${event.step}/${event.steps}`)
+        } else if (event.event === 'stage') {
+            this.view.showProgress(event.stage === 'clean' ? 'Cleaning' : 'Imaging')
+        } else if (event.event === 'image' && event.path) {
+            this.loadStreamImage(event.path)
+        }
+    }
+
+    loadStreamImage(path: string) {
+        // images load asynchronously; only show the latest one of this run
+        const request = ++this.streamImageRequest
+        NpyFileUtil
+            .import(path)
+            .then((image: StreamImage) => {
+                if (request === this.streamImageRequest) {
+                    this.view.showStreamImage(image)
+                }
+            })
+            .catch((reason) => console.log(reason))
+    }
+
     dishPropertiesDismissed(updated: AntennaModel, shouldDelete?: Boolean) {
         const antennaIndex = this.data.antennas
           .map((a: AntennaModel) => a.id === updated.id)
@@ -0,0 +1,52 @@
+import * as React from 'react';
+import StreamImage from '../../model/StreamImage';
+
+interface StreamImageViewProps {
+    image: StreamImage,
+    size: number,
+}
+
+/**
+ * Draws a streamed dirty image in grayscale, scaled from its minimum
+ * (black) to its maximum (white).
+ */
+export class StreamImageView extends React.Component<StreamImageViewProps, any> {
+    componentDidMount() {
+        this.draw()
+    }
+    componentDidUpdate() {
+        this.draw()
+    }
+    draw() {
+        const { width, height, pixels } = this.props.image
+        const canvas = this.refs.canvas as HTMLCanvasElement
+        const ctx = canvas.getContext('2d') as CanvasRenderingContext2D
+        let min = Infinity
+        let max = -Infinity
+        pixels.forEach(value => {
+            min = Math.min(min, value)
+            max = Math.max(max, value)
+        })
+        const scale = max > min ? 255 / (max - min) : 0
+        const imageData = ctx.createImageData(width, height)
+        for (let i = 0; i < pixels.length; i++) {
+            const gray = (pixels[i] - min) * scale
+            imageData.data[4 * i] = gray
+            imageData.data[4 * i + 1] = gray
+            imageData.data[4 * i + 2] = gray
+            imageData.data[4 * i + 3] = 255
+        }
+        ctx.putImageData(imageData, 0, 0)
+    }
+    render() {
+        return <canvas
+            ref='canvas'
+            className='stream-image'
+            width={this.props.image.width}
+            height={this.props.image.height}
+            style={{ width: this.props.size, height: this.props.size }}
+        />
+    }
+}
+
+export default StreamImageView
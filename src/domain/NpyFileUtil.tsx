@@ -0,0 +1,48 @@
+import StreamImage from "../model/StreamImage";
+import { promises as fs } from 'fs';
+
+const MAGIC = '\x93NUMPY'
+const DTYPES: { [descr: string]: [number, (view: DataView, offset: number) => number] } = {
+    '<f8': [8, (view, offset) => view.getFloat64(offset, true)],
+    '<f4': [4, (view, offset) => view.getFloat32(offset, true)],
+}
+
+/**
+ * Reads the 2-D float npy files written by `astroflux.py`, e.g. the
+ * incremental dirty images of `--stream`.
+ */
+class NpyFileUtil {
+    static async import(path: string): Promise<StreamImage> {
+        const data = await fs.readFile(path)
+        return NpyFileUtil.parse(data)
+    }
+    static parse(data: Buffer): StreamImage {
+        if (data.toString('latin1', 0, 6) !== MAGIC) {
+            throw new Error('not an npy file')
+        }
+        const major = data[6]
+        const headerLength = major === 1 ? data.readUInt16LE(8) : data.readUInt32LE(8)
+        const headerStart = major === 1 ? 10 : 12
+        const header = data.toString('latin1', headerStart, headerStart + headerLength)
+        const descr = /'descr':\s*'([^']+)'/.exec(header)
+        const fortran = /'fortran_order':\s*(True|False)/.exec(header)
+        const shape = /'shape':\s*\((\d+),\s*(\d+),?\s*\)/.exec(header)
+        if (!descr || !(descr[1] in DTYPES) || !fortran || !shape) {
+            throw new Error(`unsupported npy header ${header.trim()}`)
+        }
+        const [itemsize, read] = DTYPES[descr[1]]
+        const height = parseInt(shape[1])
+        const width = parseInt(shape[2])
+        const view = new DataView(data.buffer, data.byteOffset + headerStart + headerLength)
+        const pixels = new Float64Array(width * height)
+        for (let row = 0; row < height; row++) {
+            for (let col = 0; col < width; col++) {
+                const index = fortran[1] === 'True' ? col * height + row : row * width + col
+                pixels[row * width + col] = read(view, index * itemsize)
+            }
+        }
+        return { width, height, pixels }
+    }
+}
+
+export default NpyFileUtil
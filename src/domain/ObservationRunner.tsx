@@ -1,39 +1,154 @@
 import Observation from "../model/Observation"
-import { exec } from 'child_process'
+import { spawn, ChildProcess } from 'child_process'
+import { createInterface } from 'readline'
 import { join } from 'path'
 import { remote } from 'electron'
 
 const PYTHON_FILE = join(
-    remote.app.getAppPath(), 
+    remote.app.getAppPath(),
     'python',
     'astroflux.py')
 
+/**
+ * A progress line from an `astroflux.py --stream` run: a finished time
+ * `step`, an incremental dirty `image` (npy file at `path`), or the
+ * post-processing `stage` that has started.
+ */
+export interface ObservationEvent {
+    event: 'step' | 'image' | 'stage'
+    step?: number
+    steps?: number
+    elapsed?: number
+    path?: string
+    stage?: string
+}
+
+interface PendingRequest {
+    res: (result: any) => void
+    rej: (reason: any) => void
+    onEvent?: (event: ObservationEvent) => void
+}
+
+/**
+ * A long-running `astroflux.py --serve` process that keeps imports,
+ * sky maps and caches warm between observations.
+ */
+class SimulationServer {
+    private static instance: SimulationServer | null = null
+    private process: ChildProcess
+    private pending = new Map<number, PendingRequest>()
+    private nextId = 0
+
+    static get() {
+        if (!SimulationServer.instance) {
+            SimulationServer.instance = new SimulationServer()
+        }
+        return SimulationServer.instance
+    }
+
+    /**
+     * Stops the running server, if there is one.
+     */
+    static stop() {
+        if (SimulationServer.instance) {
+            SimulationServer.instance.stop()
+        }
+    }
+
+    private constructor() {
+        // `conda run` starts python as a child, so the server gets its own
+        // process group and is stopped as a group (see `stop`)
+        this.process = spawn('conda', [
+            'run', '--no-capture-output', '-n', 'base',
+            'python', '-u', PYTHON_FILE, '--serve'
+        ], { detached: process.platform !== 'win32' })
+        createInterface({ input: this.process.stdout! })
+            .on('line', (line: string) => this.onLine(line))
+        this.process.stderr!.on('data', (data: Buffer) => console.log(data.toString()))
+        this.process.on('exit', (code: number) => this.closed(`simulation server exited (${code})`))
+        this.process.on('error', (error: Error) => this.closed(`simulation server failed (${error.message})`))
+    }
+
+    request(observation: Observation, args: string[], onEvent?: (event: ObservationEvent) => void) {
+        return new Promise((res, rej) => {
+            const id = this.nextId++
+            this.pending.set(id, { res, rej, onEvent })
+            this.process.stdin!.write(JSON.stringify({ id, observation, args }) + '\n')
+        })
+    }
+
+    /**
+     * Stops the running simulation by stopping the server; pending
+     * requests are rejected and the next request starts a new server.
+     */
+    stop() {
+        this.detach()
+        if (process.platform !== 'win32' && this.process.pid) {
+            try {
+                process.kill(-this.process.pid)
+            } catch (e) {
+                console.log(e)
+            }
+        } else {
+            this.process.kill()
+        }
+    }
+
+    private detach() {
+        if (SimulationServer.instance === this) {
+            SimulationServer.instance = null
+        }
+    }
+
+    private closed(reason: string) {
+        this.detach()
+        this.pending.forEach(request => request.rej(reason))
+        this.pending.clear()
+    }
+
+    private onLine(line: string) {
+        let response
+        try {
+            response = JSON.parse(line)
+        } catch (e) {
+            console.log(line)
+            return
+        }
+        const request = this.pending.get(response.id)
+        if (!request) {
+            return
+        }
+        if (response.event) {
+            if (request.onEvent) {
+                request.onEvent(response)
+            }
+            return
+        }
+        this.pending.delete(response.id)
+        if (response.error) {
+            console.log(response.error)
+            request.rej(response.error)
+        } else {
+            request.res(response.result)
+        }
+    }
+}
+
 class ObservationRunner {
     observation: Observation
     constructor(data: Observation) {
         this.observation = data
     }
-    run(skyOpt: string) {
-        // stringify the JSON
-        return new Promise((res, rej) => {
-            const stringData = JSON.stringify(this.observation)
-            exec(`conda run -n base python ${PYTHON_FILE} --json='${stringData}' --sky=${skyOpt} --fast --dump`, (err, stdout, stderr) => {
-                if (err) {
-                    console.log(err)
-                    rej(err)
-                    return
-                }
-                if (stderr) {
-                    console.log(stderr)
-                    rej(stderr)
-                    return
-                }
-                console.log(stdout)
-                const result = JSON.parse(stdout)
-                res(result)
-            })
-        })
+    run(skyOpt: string, onEvent?: (event: ObservationEvent) => void) {
+        const args = [`--sky=${skyOpt}`, '--fast']
+        if (onEvent) {
+            args.push('--stream')
+        }
+        return SimulationServer.get().request(this.observation, args, onEvent)
+    }
+    cancel() {
+        SimulationServer.stop()
     }
 }
 
-export default ObservationRunner
\ No newline at end of file
+export default ObservationRunner
@@ -0,0 +1,10 @@
+/**
+ * A 2-D image of `width` x `height` pixel values, stored row by row.
+ */
+interface StreamImage {
+    width: number,
+    height: number,
+    pixels: Float64Array,
+}
+
+export default StreamImage